@@ -1,4 +1,8 @@
-from flask import Flask, request, jsonify
+# gevent must patch the standard library before anything else imports it
+from gevent import monkey
+monkey.patch_all()
+
+from flask import Flask, request, jsonify, make_response
 from utils.utils import (
     init_session_state_variables,
     dataset_unzip,
@@ -6,19 +10,27 @@ from utils.utils import (
     check_if_dataset_exists,
 )
 from utils.UNet_2D import init_model
-from utils.variables import data_path
-from utils.img_processing import resize_predicted_seg
-from utils.predict_seg import patient_has_changed_update_token, predict_btn_click
+from utils.variables import data_path, VOLUME_SLICES
+from utils.predict_seg import patient_has_changed_update_token, predict_segmentation_labels
 from utils.session import SESSION_STATE
+from utils.cache_helpers import LRUCache, get_files_mtime_ns, get_response_cache_key
 from utils.image_processing_helpers import (
-    normalize_image_slice,
+    normalize_image_slices,
     filter_prediction_by_class,
     extract_slice_by_plane,
     create_slicer_function,
     get_gif_animation_params,
     render_slice_with_overlay,
+    render_slice_with_overlay_array,
+    pad_to_square,
+    encode_png_base64,
+    render_gif_frame_indices,
+    encode_gif_base64,
+    encode_webp_base64,
+    resize_label_volume,
 )
 from utils.metrics_helpers import (
+    count_class_voxels,
     calculate_class_metrics,
     calculate_total_tumor_metrics,
     get_class_explanations,
@@ -33,55 +45,128 @@ from utils.three_views_helpers import (
 import nibabel as nib
 import matplotlib.pyplot as plt
 import numpy as np
-import base64
-import io
+import atexit
+import functools
 import cv2
 import os
+import shutil
+import threading
+import time
+from datetime import datetime
 from flask_cors import CORS
-import imageio
+import gevent
+from gevent.queue import Queue, Empty
+from gevent.threadpool import ThreadPoolExecutor
 from utils.skin_detection import predict_skin_cancer, SKIN_CANCER_CLASSES
-from utils.lung_detection import predict_lung_condition
-from utils.eye_detection import predict_dr_severity
-from db import engine
+from utils.lung_detection import predict_lung_condition, load_lung_model
+from utils.eye_detection import predict_dr_severity, load_eye_model
+from db import engine, db_session
 from models import Base, SignInLog, User
 from werkzeug.security import generate_password_hash, check_password_hash
-import base64
 
 DEFAULT_WORLD_COORDS = {"x": -92.0, "y": 114.0, "z": 61.0}
 
+# Predicted segmentation volumes, keyed by (patient_root, files mtime, reference shape)
+PREDICTION_CACHE = LRUCache(maxsize=8)
+# Segmentation metrics of the cached predictions, sharing PREDICTION_CACHE's keys
+METRICS_CACHE = LRUCache(maxsize=8)
+# Decoded modality volumes and their affines, keyed by (file path, mtime)
+VOLUME_CACHE = LRUCache(maxsize=16)
+# Inverse affines of modality files, keyed by (file path, mtime)
+INVERSE_AFFINE_CACHE = LRUCache(maxsize=64)
+
+# Rendered JSON bodies of the image routes, keyed by a BLAKE2b digest of the request
+RESPONSE_CACHE = LRUCache(maxsize=256)
+
+# /get_slice images are upscaled to the 600x600 of the former 6x6 in, 100 dpi figure
+SLICE_IMAGE_SIZE = 600
+
+# Uploads are copied to disk in 1 MiB chunks by up to 4 native threads
+UPLOAD_CHUNK_SIZE = 1 << 20
+UPLOAD_WRITE_WORKERS = 4
+
+# GIF frames are rendered in parallel on native threads, at most 8 at a time
+GIF_RENDER_WORKERS = min(8, os.cpu_count() or 1)
+
+# Sign-in log rows are queued and inserted in batches of up to 100, at most 250 ms apart
+SIGNIN_LOG_BATCH_SIZE = 100
+SIGNIN_LOG_FLUSH_INTERVAL = 0.25
+_signin_log_queue = Queue()
+_signin_log_worker = None
+
 app = Flask(__name__)
 CORS(app, origins=["http://localhost:8080", "http://localhost:5173", "http://localhost:3000"])
+# Patient folders hold several uncompressed NIfTI volumes
+app.config["MAX_CONTENT_LENGTH"] = 2 * 1024 ** 3
 
-# Initialize database tables if a database is configured
-if engine is not None:
-    try:
-        # Import models to ensure they're registered with Base
-        from models import User, SignInLog
-        Base.metadata.create_all(bind=engine)
-        print("[INFO] Database tables initialized successfully.")
-    except Exception as e:
-        import traceback
-        print(f"[WARN] Failed to initialize database tables: {e}")
-        print(f"[WARN] Traceback: {traceback.format_exc()}")
-else:
-    print("[INFO] DATABASE_URL not set - sign-in logs and user accounts will not be persisted.")
-
-# Load model once
-model = init_model()
 init_session_state_variables()
 
-# Initialize dataset
-dataset_unzip()
-rename_wrong_file(data_path)
-check_if_dataset_exists()
+# The UNet weights, the dataset check and the table creation are deferred to first use
+# so workers boot without blocking on them
+_model = None
+_model_lock = threading.Lock()
+_dataset_ready = False
+_dataset_lock = threading.Lock()
+_database_ready = False
+_database_lock = threading.Lock()
+
+
+def get_model():
+    """Return the segmentation model, loading it on first use."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = init_model()
+    return _model
+
+
+def ensure_dataset_ready():
+    """Unzip and validate the dataset the first time a volume is requested."""
+    global _dataset_ready
+    if not _dataset_ready:
+        with _dataset_lock:
+            if not _dataset_ready:
+                dataset_unzip()
+                rename_wrong_file(data_path)
+                check_if_dataset_exists()
+                _dataset_ready = True
+
+
+def ensure_database_tables():
+    """Initialize database tables once, before the first auth request touches them."""
+    global _database_ready
+    if _database_ready or engine is None:
+        return
+    with _database_lock:
+        if _database_ready:
+            return
+        try:
+            Base.metadata.create_all(bind=engine)
+            print("[INFO] Database tables initialized successfully.")
+        except Exception as e:
+            import traceback
+            print(f"[WARN] Failed to initialize database tables: {e}")
+            print(f"[WARN] Traceback: {traceback.format_exc()}")
+        _database_ready = True
 
 
-def fig_to_base64(fig):
-    """Encode matplotlib figure to base64 string."""
-    buf = io.BytesIO()
-    fig.savefig(buf, format="png", bbox_inches='tight')
-    buf.seek(0)
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+# With PRELOAD_MODELS set (together with gunicorn --preload) the Keras and ViT weights are loaded
+# once in the master process and shared copy-on-write by the forked workers
+if os.getenv("PRELOAD_MODELS", "").strip().lower() in ("1", "true", "yes"):
+    get_model()
+    load_eye_model()
+    load_lung_model()
+
+if engine is None:
+    print("[INFO] DATABASE_URL not set - sign-in logs and user accounts will not be persisted.")
+
+
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    """Return the request's database connection to the pool."""
+    if db_session is not None:
+        db_session.remove()
 
 
 #############################################
@@ -89,16 +174,72 @@ def fig_to_base64(fig):
 #############################################
 
 
+def persist_signin_logs(entries):
+    """Insert a batch of sign-in log rows in one round-trip using the worker's own pooled session."""
+    db = db_session()
+    try:
+        # Core executemany insert: no ORM objects, identity map or unit-of-work flush
+        db.execute(SignInLog.__table__.insert(), entries)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[WARN] Failed to persist {len(entries)} sign-in log(s): {e}")
+    finally:
+        db_session.remove()
+
+
+def flush_signin_logs_forever():
+    """Drain the sign-in log queue, grouping entries that arrive within the flush interval."""
+    while True:
+        batch = [_signin_log_queue.get()]
+        deadline = time.monotonic() + SIGNIN_LOG_FLUSH_INTERVAL
+        while len(batch) < SIGNIN_LOG_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_signin_log_queue.get(timeout=remaining))
+            except Empty:
+                break
+        persist_signin_logs(batch)
+
+
+def drain_signin_logs():
+    """Persist every sign-in log row still queued, so the ones accepted just before shutdown are kept."""
+    while True:
+        batch = []
+        while len(batch) < SIGNIN_LOG_BATCH_SIZE:
+            try:
+                batch.append(_signin_log_queue.get_nowait())
+            except Empty:
+                break
+        if not batch:
+            return
+        persist_signin_logs(batch)
+
+
+# Covers plain interpreter exits; gunicorn workers also call it from the worker_exit hook
+atexit.register(drain_signin_logs)
+
+
+def enqueue_signin_log(entry):
+    """Queue a sign-in log row, starting the flush greenlet in this process if needed."""
+    global _signin_log_worker
+    if _signin_log_worker is None or _signin_log_worker.dead:
+        _signin_log_worker = gevent.spawn(flush_signin_logs_forever)
+    _signin_log_queue.put(entry)
+
+
 @app.route("/api/auth/signup", methods=["POST"])
 def signup():
     """
     Register a new user account.
     """
-    from db import SessionLocal
     import traceback
 
-    if SessionLocal is None:
+    if db_session is None:
         return jsonify({"error": "Database not configured. Please set DATABASE_URL environment variable."}), 500
+    ensure_database_tables()
 
     data = request.get_json() or {}
     email = data.get("email", "").strip().lower()
@@ -118,7 +259,7 @@ def signup():
 
     db = None
     try:
-        db = SessionLocal()
+        db = db_session()
         if db is None:
             return jsonify({"error": "Failed to create database session"}), 500
 
@@ -137,7 +278,6 @@ def signup():
         )
         db.add(new_user)
         db.commit()
-        db.refresh(new_user)
 
         return jsonify({
             "status": "success",
@@ -155,9 +295,6 @@ def signup():
         print(f"[ERROR] Failed to create user: {e}")
         print(f"[ERROR] Traceback: {error_trace}")
         return jsonify({"error": f"Failed to create account: {str(e)}"}), 500
-    finally:
-        if db:
-            db.close()
 
 
 @app.route("/api/auth/signin", methods=["POST"])
@@ -165,11 +302,11 @@ def signin():
     """
     Authenticate a user and return user data.
     """
-    from db import SessionLocal
     import traceback
 
-    if SessionLocal is None:
+    if db_session is None:
         return jsonify({"error": "Database not configured. Please set DATABASE_URL environment variable."}), 500
+    ensure_database_tables()
 
     data = request.get_json() or {}
     email = data.get("email", "").strip().lower()
@@ -182,12 +319,16 @@ def signin():
 
     db = None
     try:
-        db = SessionLocal()
+        db = db_session()
         if db is None:
             return jsonify({"error": "Failed to create database session"}), 500
 
-        # Find user by email
-        user = db.query(User).filter(User.email == email).first()
+        # Find user by email (only the needed columns, no ORM object hydration)
+        user = (
+            db.query(User.email, User.password_hash, User.full_name, User.speciality)
+            .filter(User.email == email)
+            .first()
+        )
         if not user:
             return jsonify({"error": "Invalid email or password"}), 401
 
@@ -195,22 +336,18 @@ def signin():
         if not check_password_hash(user.password_hash, password):
             return jsonify({"error": "Invalid email or password"}), 401
 
-        # Log sign-in event
+        # Log sign-in event in the background so the response does not wait on the insert
         ip_address = request.headers.get("X-Forwarded-For", request.remote_addr)
         user_agent = request.headers.get("User-Agent", "")
-        try:
-            log = SignInLog(
-                email=user.email,
-                full_name=user.full_name,
-                speciality=user.speciality,
-                ip_address=ip_address,
-                user_agent=user_agent[:512],
-            )
-            db.add(log)
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            print(f"[WARN] Failed to log sign-in: {e}")
+        enqueue_signin_log({
+            "email": user.email,
+            "full_name": user.full_name,
+            "speciality": user.speciality,
+            "ip_address": ip_address,
+            "user_agent": user_agent[:512],
+            # Stamped now: the batched insert may run much later than the sign-in
+            "created_at": datetime.utcnow(),
+        })
 
         return jsonify({
             "status": "success",
@@ -225,9 +362,6 @@ def signin():
         print(f"[ERROR] Sign-in error: {e}")
         print(f"[ERROR] Traceback: {error_trace}")
         return jsonify({"error": f"Authentication failed: {str(e)}"}), 500
-    finally:
-        if db:
-            db.close()
 
 
 @app.route("/api/auth/signin-log", methods=["POST"])
@@ -238,11 +372,10 @@ def signin_log():
     This does NOT perform authentication; it only logs successful sign-ins
     triggered from the frontend after a user is considered logged in.
     """
-    from db import SessionLocal  # imported lazily to avoid circulars
-
-    if SessionLocal is None:
+    if db_session is None:
         # Database not configured – do not fail the frontend, just acknowledge.
         return jsonify({"status": "ok", "message": "Database not configured; log not persisted"}), 200
+    ensure_database_tables()
 
     data = request.get_json() or {}
     email = data.get("email")
@@ -256,29 +389,48 @@ def signin_log():
     ip_address = request.headers.get("X-Forwarded-For", request.remote_addr)
     user_agent = request.headers.get("User-Agent", "")
 
-    db = SessionLocal()
-    try:
-        log = SignInLog(
-            email=email,
-            full_name=full_name,
-            speciality=speciality,
-            ip_address=ip_address,
-            user_agent=user_agent[:512],  # safety truncate
-        )
-        db.add(log)
-        db.commit()
-        return jsonify({"status": "ok"}), 201
-    except Exception as e:
-        db.rollback()
-        print(f"[WARN] Failed to persist sign-in log: {e}")
-        # Do not break login flow if logging fails
-        return jsonify({"status": "ok", "message": "Failed to persist log"}), 200
-    finally:
-        db.close()
+    # Queued for a batched insert; a failed insert must not break the login flow
+    enqueue_signin_log({
+        "email": email,
+        "full_name": full_name,
+        "speciality": speciality,
+        "ip_address": ip_address,
+        "user_agent": user_agent[:512],  # safety truncate
+        "created_at": datetime.utcnow(),
+    })
+    # Accepted, not yet stored: the row is inserted by the next batch
+    return jsonify({"status": "ok"}), 202
+
+
+def save_upload(file_storage, file_path):
+    """Stream an uploaded file to disk, using zero-copy sendfile when it is spooled to a real file."""
+    stream = file_storage.stream
+    with open(file_path, "wb", buffering=0) as dst:
+        try:
+            src_fd = stream.fileno()
+        except (AttributeError, OSError):
+            # In-memory upload (small files are kept in a BytesIO)
+            shutil.copyfileobj(stream, dst, length=UPLOAD_CHUNK_SIZE)
+            return
+
+        start = offset = stream.tell()
+        try:
+            while True:
+                sent = os.sendfile(dst.fileno(), src_fd, offset, 64 * UPLOAD_CHUNK_SIZE)
+                if sent == 0:
+                    break
+                offset += sent
+        except (AttributeError, OSError):
+            # sendfile unavailable (non-Linux) or unsupported by the filesystem
+            dst.seek(0)
+            dst.truncate()
+            stream.seek(start)
+            shutil.copyfileobj(stream, dst, length=UPLOAD_CHUNK_SIZE)
 
 
 def get_modality_file(patient_path, modality):
     """Get the file path for a specific modality."""
+    ensure_dataset_ready()
     patient_name = os.path.basename(os.path.normpath(patient_path))
     suffix = {
         "FLAIR": "_flair.nii",
@@ -293,11 +445,33 @@ def get_modality_file(patient_path, modality):
     return file_path
 
 
-def world_to_voxel(affine, coords):
-    """Convert world coordinates to voxel coordinates."""
+def load_volume(file_path):
+    """Load a NIfTI volume as float32 along with its affine, reusing decoded arrays."""
+    cache_key = (file_path, os.stat(file_path).st_mtime_ns)
+    return VOLUME_CACHE.get_or_compute(cache_key, lambda: _read_volume(file_path))
+
+
+def _read_volume(file_path):
+    """Read a NIfTI file through its (memory-mapped) data proxy as float32."""
+    nifti_img = nib.load(file_path, mmap=True)
+    volume = np.asarray(nifti_img.dataobj, dtype=np.float32)
+    volume.setflags(write=False)
+    return volume, nifti_img.affine
+
+
+def get_inverse_affine(file_path):
+    """Return the cached world-to-voxel (inverse) affine of a NIfTI file."""
+    cache_key = (file_path, os.stat(file_path).st_mtime_ns)
+    return INVERSE_AFFINE_CACHE.get_or_compute(
+        cache_key, lambda: np.linalg.inv(load_volume(file_path)[1])
+    )
+
+
+def world_to_voxel(inv_affine, coords):
+    """Convert world coordinates to voxel coordinates using a precomputed inverse affine."""
     try:
         point = np.array([coords["x"], coords["y"], coords["z"], 1.0])
-        voxel = np.linalg.inv(affine).dot(point)[:3]
+        voxel = (inv_affine @ point)[:3]
         return np.round(voxel).astype(int)
     except Exception:
         return np.array([
@@ -307,41 +481,125 @@ def world_to_voxel(affine, coords):
         ], dtype=int)
 
 
-def get_prediction_volume(patient_path, reference_shape):
-    """Returns the predicted segmentation volume (same shape as reference image)."""
+def get_patient_root(patient_path):
+    """Return the common path prefix of a patient's NIfTI files."""
     patient_name = os.path.basename(os.path.normpath(patient_path))
-    patient_root = os.path.join(patient_path, patient_name)
+    return os.path.join(patient_path, patient_name)
+
 
+def get_prediction_cache_key(patient_path, reference_shape):
+    """Key a patient's prediction on its files' mtime so edited NIfTI files invalidate it."""
+    patient_root = get_patient_root(patient_path)
+    mtime_ns = get_files_mtime_ns(patient_root + "_*.nii*")
+    return patient_root, mtime_ns, tuple(reference_shape)
+
+
+def get_prediction_volume(patient_path, reference_shape, slice_indices=None):
+    """
+    Returns the predicted segmentation volume (same shape as reference image).
+    With slice_indices, only those axial slices are predicted (others stay background)
+    unless the full prediction is already cached.
+    """
     current_patient = SESSION_STATE.get("current_patient")
     if current_patient != patient_path:
         patient_has_changed_update_token()
         SESSION_STATE["current_patient"] = patient_path
 
-    pred_raw = predict_btn_click(model, patient_root)
-    if pred_raw is None:
+    cache_key = get_prediction_cache_key(patient_path, reference_shape)
+    patient_root = get_patient_root(patient_path)
+    if slice_indices is not None:
+        full_pred_vol = PREDICTION_CACHE.get(cache_key)
+        if full_pred_vol is not None:
+            return full_pred_vol
+        slice_indices = tuple(slice_indices)
+        return PREDICTION_CACHE.get_or_compute(
+            cache_key + (slice_indices,),
+            lambda: _compute_prediction_volume(patient_root, reference_shape, slice_indices),
+        )
+
+    return PREDICTION_CACHE.get_or_compute(
+        cache_key, lambda: _compute_prediction_volume(patient_root, reference_shape)
+    )
+
+
+def get_prediction_metrics(patient_path, reference_shape, affine):
+    """Returns (class_metrics, total_tumor_metrics, voxel_spacing) for the patient's prediction."""
+    pred_vol = get_prediction_volume(patient_path, reference_shape)
+    cache_key = get_prediction_cache_key(patient_path, reference_shape)
+    return METRICS_CACHE.get_or_compute(
+        cache_key, lambda: _compute_prediction_metrics(pred_vol, affine)
+    )
+
+
+def _compute_prediction_metrics(pred_vol, affine):
+    """Compute the per-class and total tumor volumes of a predicted segmentation."""
+    voxel_spacing = np.abs(np.diag(affine[:3, :3]))
+    voxel_volume_mm3 = np.prod(voxel_spacing)
+
+    counts = count_class_voxels(pred_vol)
+    class_metrics = calculate_class_metrics(pred_vol, voxel_volume_mm3, counts)
+    total_tumor_metrics = calculate_total_tumor_metrics(pred_vol, voxel_volume_mm3, counts)
+    return class_metrics, total_tumor_metrics, voxel_spacing.tolist()
+
+
+def _compute_prediction_volume(patient_root, reference_shape, slice_indices=None):
+    """Run the UNet on a patient (or only some axial slices) and reshape its output to the reference image shape."""
+    pred_labels = predict_segmentation_labels(get_model(), patient_root, slice_indices)
+    if pred_labels is None:
         raise ValueError("Failed to generate prediction")
 
-    if len(pred_raw.shape) != 4 or pred_raw.shape[3] != 4:
-        raise ValueError(f"Invalid prediction shape: {pred_raw.shape}")
+    if len(pred_labels.shape) != 3:
+        raise ValueError(f"Invalid prediction shape: {pred_labels.shape}")
 
-    pred_resized = resize_predicted_seg(pred_raw)
-    pred_classes = np.argmax(pred_resized, axis=3).astype(np.int16)
-    pred_vol = np.moveaxis(pred_classes, 0, 2)
+    # Nearest-neighbor resizing commutes with argmax, so the labels (taken on the device at
+    # model resolution) are resized as a uint8 (H, W, D) volume
+    pred_vol = np.ascontiguousarray(pred_labels.transpose(1, 2, 0))
+    pred_vol = resize_label_volume(pred_vol, (240, 240, pred_vol.shape[2]))
 
-    if pred_vol.shape != reference_shape:
-        resized_pred = np.zeros(reference_shape, dtype=np.int16)
-        limit = min(pred_vol.shape[2], reference_shape[2])
-        for z in range(limit):
-            resized_pred[:, :, z] = cv2.resize(
-                pred_vol[:, :, z].astype(np.float32),
-                (reference_shape[1], reference_shape[0]),
-                interpolation=cv2.INTER_NEAREST,
-            ).astype(np.int16)
-        pred_vol = resized_pred
+    if slice_indices is not None:
+        # Scatter the predicted slices into an otherwise background volume
+        predicted_slices = pred_vol
+        if predicted_slices.shape[:2] != tuple(reference_shape[:2]):
+            predicted_slices = resize_label_volume(
+                predicted_slices, (reference_shape[0], reference_shape[1], predicted_slices.shape[2])
+            )
+        pred_vol = np.zeros(reference_shape, dtype=np.uint8)
+        pred_vol[:, :, list(slice_indices)] = predicted_slices
+    elif pred_vol.shape != reference_shape:
+        pred_vol = resize_label_volume(pred_vol, reference_shape)
 
+    # Cached volumes are shared between requests, so guard them against in-place edits
+    pred_vol.setflags(write=False)
     return pred_vol
 
 
+def cached_json_response(view):
+    """
+    Serve repeated requests with an identical JSON body from RESPONSE_CACHE.
+    The key includes the patient files' mtime, so edited volumes are never served stale.
+    """
+    @functools.wraps(view)
+    def wrapper():
+        data = request.get_json(silent=True) or {}
+        patient_path = data.get("patient_path")
+        if not isinstance(patient_path, str) or not patient_path:
+            return view()
+
+        mtime_ns = get_files_mtime_ns(get_patient_root(patient_path) + "_*.nii*")
+        cache_key = get_response_cache_key(request.path, mtime_ns, data)
+
+        cached_body = RESPONSE_CACHE.get(cache_key)
+        if cached_body is not None:
+            return app.response_class(cached_body, mimetype="application/json")
+
+        response = make_response(view())
+        if response.status_code == 200:
+            RESPONSE_CACHE.put(cache_key, response.get_data())
+        return response
+
+    return wrapper
+
+
 #############################################
 #               ROUTES
 #############################################
@@ -386,20 +644,28 @@ def upload_folder():
         
         # Save each file to the patient directory
         saved_files = []
+        upload_jobs = []
+        created_dirs = {patient_dir}
         for file in files:
             if file.filename:
                 # Preserve directory structure if present
-                filename = file.filename
                 # Remove folder name prefix if present (e.g., "Brats20_Test_001/file.nii" -> "file.nii")
-                if "/" in filename:
-                    filename = filename.split("/", 1)[1]
+                _, sep, tail = file.filename.partition("/")
+                filename = tail if sep else file.filename
                 
                 file_path = os.path.join(patient_dir, filename)
-                # Create subdirectories if needed
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                # Create subdirectories if needed (each one only once per upload)
+                file_dir = os.path.dirname(file_path)
+                if file_dir not in created_dirs:
+                    os.makedirs(file_dir, exist_ok=True)
+                    created_dirs.add(file_dir)
                 
-                file.save(file_path)
+                upload_jobs.append((file, file_path))
                 saved_files.append(filename)
+
+        # Write the files in parallel on native threads (disk I/O, not CPU, bound)
+        with ThreadPoolExecutor(max_workers=UPLOAD_WRITE_WORKERS) as executor:
+            list(executor.map(lambda job: save_upload(*job), upload_jobs))
         
         return jsonify({
             "success": True,
@@ -417,6 +683,7 @@ def upload_folder():
 
 
 @app.route("/get_slice", methods=["POST"])
+@cached_json_response
 def get_slice():
     """Get a single slice with prediction overlay."""
     data = request.get_json()
@@ -431,7 +698,7 @@ def get_slice():
 
     try:
         modality_file = get_modality_file(patient_path, modality)
-        img = nib.load(modality_file).get_fdata()
+        img, _ = load_volume(modality_file)
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 404
 
@@ -447,9 +714,12 @@ def get_slice():
     filtered_pred = filter_prediction_by_class(slice_pred, selected_class)
     
     # Render slice with overlay
-    fig = render_slice_with_overlay(slice_img, filtered_pred)
-    encoded = fig_to_base64(fig)
-    plt.close(fig)
+    image = render_slice_with_overlay_array(slice_img, filtered_pred)
+    # Nearest-neighbour keeps the voxels and class borders crisp, as the figure's imshow did
+    image = cv2.resize(
+        pad_to_square(image), (SLICE_IMAGE_SIZE, SLICE_IMAGE_SIZE), interpolation=cv2.INTER_NEAREST
+    )
+    encoded = encode_png_base64(image)
 
     return jsonify({"image": encoded})
 
@@ -466,24 +736,18 @@ def get_analysis():
 
     try:
         flair_file = get_modality_file(patient_path, "FLAIR")
-        flair_img = nib.load(flair_file)
-        img = flair_img.get_fdata()
-        affine = flair_img.affine
+        img, affine = load_volume(flair_file)
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 404
 
     try:
-        pred_vol = get_prediction_volume(patient_path, img.shape)
+        class_metrics, total_tumor_metrics, voxel_spacing = get_prediction_metrics(
+            patient_path, img.shape, affine
+        )
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
 
-    # Calculate voxel spacing and volume
-    voxel_spacing = np.abs(np.diag(affine[:3, :3]))
-    voxel_volume_mm3 = np.prod(voxel_spacing)
-
-    # Calculate metrics
-    class_metrics = calculate_class_metrics(pred_vol, voxel_volume_mm3)
-    total_tumor_metrics = calculate_total_tumor_metrics(pred_vol, voxel_volume_mm3)
+    # Only the selection depends on the request; the metrics themselves are cached
     selected_metrics = get_selected_class_metrics(class_metrics, selected_class)
 
     # Get explanations
@@ -498,12 +762,13 @@ def get_analysis():
             "selected_class_metrics": selected_metrics
         },
         "explanation": explanation,
-        "voxel_spacing_mm": voxel_spacing.tolist(),
+        "voxel_spacing_mm": voxel_spacing,
         "image_dimensions": list(img.shape)
     })
 
 
 @app.route("/get_gif", methods=["POST"])
+@cached_json_response
 def get_gif():
     """Generate animated GIF of slices through the volume."""
     data = request.get_json()
@@ -511,61 +776,70 @@ def get_gif():
     modality = data.get("modality")
     plane = data.get("plane", "Axial")
     selected_class = data.get("class", "All")
+    # "webp" returns a (much smaller) animated WebP under the "webp" key instead of a GIF
+    output_format = str(data.get("format", "gif")).lower()
+    if output_format not in ("gif", "webp"):
+        return jsonify({"error": f"Unsupported format: {output_format}"}), 400
 
     try:
         modality_file = get_modality_file(patient_path, modality)
-        img = nib.load(modality_file).get_fdata()
+        img, _ = load_volume(modality_file)
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 404
 
+    # Get animation parameters first: an axial sweep only needs its sampled slices predicted
+    num_slices = img.shape[{"Axial": 2, "Sagittal": 0}.get(plane, 1)]
+    stride, fps = get_gif_animation_params(plane, num_slices)
+    idxs = range(0, num_slices, stride)
+    slice_indices = None
+    if plane == "Axial":
+        slice_indices = [idx for idx in idxs if idx < min(VOLUME_SLICES, num_slices)]
+
     try:
-        pred_vol = get_prediction_volume(patient_path, img.shape)
+        pred_vol = get_prediction_volume(patient_path, img.shape, slice_indices)
     except ValueError as e:
         return jsonify({"error": str(e)}), 500
 
-    # Create slicer function and get animation parameters
-    num_slices, slicer = create_slicer_function(img, pred_vol, plane)
-    stride, fps = get_gif_animation_params(plane, num_slices)
-    idxs = range(0, num_slices, stride)
+    # Create slicer function
+    _, slicer = create_slicer_function(img, pred_vol, plane)
 
-    # Generate frames
-    frames = []
-    target_h, target_w = 256, 256
+    if len(idxs) == 0:
+        return jsonify({"error": f"No frames generated. num_slices={num_slices}"}), 500
 
-    for idx in idxs:
+    # Generate frames as palette indices so the GIF needs no per-frame quantization
+    target_size = 256
+    frames = np.empty((len(idxs), target_size, target_size), dtype=np.uint8)
+
+    def render_frame(frame_idx, idx):
         slice_img, slice_pred = slicer(idx)
         
         # Ensure shapes match
         if slice_pred.shape != slice_img.shape:
             slice_pred = cv2.resize(
-                slice_pred.astype(np.float32),
+                np.ascontiguousarray(slice_pred),
                 (slice_img.shape[1], slice_img.shape[0]),
                 interpolation=cv2.INTER_NEAREST
-            ).astype(np.int16)
+            )
         
         # Filter and render
         filtered_pred = filter_prediction_by_class(slice_pred, selected_class)
-        fig = render_slice_with_overlay(slice_img, filtered_pred, figsize=(4, 4), dpi=100)
-        fig.canvas.draw()
-        
-        frame = np.asarray(fig.canvas.renderer.buffer_rgba())[..., :3]
-        frame = cv2.resize(frame, (target_w, target_h))
-        frames.append(frame)
-        plt.close(fig)
+        frames[frame_idx] = render_gif_frame_indices(slice_img, filtered_pred, target_size)
 
-    if len(frames) == 0:
-        return jsonify({"error": f"No frames generated. num_slices={num_slices}"}), 500
+    # Frames are independent and OpenCV/Numba release the GIL, so render them on native threads
+    with ThreadPoolExecutor(max_workers=GIF_RENDER_WORKERS) as executor:
+        list(executor.map(render_frame, range(len(idxs)), idxs))
+
+    if output_format == "webp":
+        return jsonify({"webp": encode_webp_base64(frames, fps)})
 
     # Create GIF
-    gif_bytes = io.BytesIO()
-    imageio.mimsave(gif_bytes, frames, format="GIF", fps=fps, loop=0)
-    gif_bytes.seek(0)
-    encoded_gif = base64.b64encode(gif_bytes.read()).decode("utf-8")
+    encoded_gif = encode_gif_base64(frames, fps)
 
     return jsonify({"gif": encoded_gif})
 
 
 @app.route("/get_three_views", methods=["POST"])
+@cached_json_response
 def get_three_views():
     """Returns a combined visualization of sagittal, coronal, and axial views with prediction overlay."""
     data = request.get_json()
@@ -582,9 +856,7 @@ def get_three_views():
 
     try:
         flair_file = get_modality_file(patient_path, "FLAIR")
-        flair_img = nib.load(flair_file)
-        img = flair_img.get_fdata()
-        affine = flair_img.affine
+        img, _ = load_volume(flair_file)
     except FileNotFoundError as e:
         return jsonify({"error": str(e)}), 404
 
@@ -594,7 +866,7 @@ def get_three_views():
         return jsonify({"error": str(e)}), 500
 
     # Extract slices and calculate crosshair positions
-    voxel_coords = world_to_voxel(affine, coords)
+    voxel_coords = world_to_voxel(get_inverse_affine(flair_file), coords)
     sagittal_img, sagittal_pred, coronal_img, coronal_pred, axial_img, axial_pred = extract_three_view_slices(
         img, pred_vol, voxel_coords
     )
@@ -605,9 +877,9 @@ def get_three_views():
     )
 
     # Normalize images and filter predictions
-    sagittal_img_norm = normalize_image_slice(sagittal_img)
-    coronal_img_norm = normalize_image_slice(coronal_img)
-    axial_img_norm = normalize_image_slice(axial_img)
+    sagittal_img_norm, coronal_img_norm, axial_img_norm = normalize_image_slices(
+        [sagittal_img, coronal_img, axial_img]
+    )
     
     sagittal_pred = filter_prediction_by_class(sagittal_pred, selected_class)
     coronal_pred = filter_prediction_by_class(coronal_pred, selected_class)
@@ -621,11 +893,9 @@ def get_three_views():
     ]
 
     # Render and encode
-    fig = render_three_views(views, coords)
-    encoded = fig_to_base64(fig)
-    plt.close(fig)
+    image_rgb = render_three_views(views, coords)
 
-    return jsonify({"image": encoded})
+    return jsonify({"image": encode_png_base64(image_rgb)})
 
 
 @app.route("/analyze_skin", methods=["POST"])
@@ -639,18 +909,11 @@ def analyze_skin():
         if image_file.filename == '':
             return jsonify({"error": "No image file selected"}), 400
         
-        # Predict skin cancer
-        result = predict_skin_cancer(image_file)
+        # Predict skin cancer (?heatmap=0 skips the attention heatmap)
+        return_heatmap = request.args.get("heatmap", "1") != "0"
+        result = predict_skin_cancer(image_file, return_heatmap=return_heatmap)
         
-        # Encode heatmap to base64
-        _, buffer = cv2.imencode('.jpg', result['heatmap'])
-        heatmap_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Encode raw heatmap to base64
-        _, buffer_raw = cv2.imencode('.jpg', result['heatmap_raw'])
-        heatmap_raw_base64 = base64.b64encode(buffer_raw).decode('utf-8')
-        
-        return jsonify({
+        response = {
             "success": True,
             "predicted_class": result['predicted_class'],
             "result_type": result['result_type'],
@@ -658,11 +921,14 @@ def analyze_skin():
             "model_precision": result['model_precision'],
             "top3_predictions": result['top3_predictions'],
             "all_predictions": result['all_predictions'],
-            "heatmap": heatmap_base64,
-            "heatmap_raw": heatmap_raw_base64,
             "explanation": result['explanation'],
             "recommendations": result['recommendations']
-        })
+        }
+        if return_heatmap:
+            response["heatmap"] = result['heatmap']
+            response["heatmap_raw"] = result['heatmap_raw']
+        
+        return jsonify(response)
         
     except FileNotFoundError as e:
         return jsonify({"error": f"Model file not found: {str(e)}"}), 500
@@ -687,14 +953,6 @@ def analyze_lung():
         # Predict lung condition
         result = predict_lung_condition(image_file)
         
-        # Encode heatmap to base64
-        _, buffer = cv2.imencode('.jpg', result['heatmap'])
-        heatmap_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Encode raw heatmap to base64
-        _, buffer_raw = cv2.imencode('.jpg', result['heatmap_raw'])
-        heatmap_raw_base64 = base64.b64encode(buffer_raw).decode('utf-8')
-        
         return jsonify({
             "success": True,
             "predicted_class": result['predicted_class'],
@@ -703,8 +961,8 @@ def analyze_lung():
             "model_precision": result['model_precision'],
             "top3_predictions": result['top3_predictions'],
             "all_predictions": result['all_predictions'],
-            "heatmap": heatmap_base64,
-            "heatmap_raw": heatmap_raw_base64,
+            "heatmap": result['heatmap'],
+            "heatmap_raw": result['heatmap_raw'],
             "explanation": result['explanation'],
             "recommendations": result['recommendations']
         })
@@ -732,14 +990,6 @@ def analyze_eye():
         # Predict diabetic retinopathy severity
         result = predict_dr_severity(image_file)
         
-        # Encode heatmap to base64
-        _, buffer = cv2.imencode('.jpg', result['heatmap'])
-        heatmap_base64 = base64.b64encode(buffer).decode('utf-8')
-        
-        # Encode raw heatmap to base64
-        _, buffer_raw = cv2.imencode('.jpg', result['heatmap_raw'])
-        heatmap_raw_base64 = base64.b64encode(buffer_raw).decode('utf-8')
-        
         return jsonify({
             "success": True,
             "predicted_class": result['predicted_class'],
@@ -749,8 +999,8 @@ def analyze_eye():
             "model_precision": result['model_precision'],
             "top3_predictions": result['top3_predictions'],
             "all_predictions": result['all_predictions'],
-            "heatmap": heatmap_base64,
-            "heatmap_raw": heatmap_raw_base64,
+            "heatmap": result['heatmap'],
+            "heatmap_raw": result['heatmap_raw'],
             "explanation": result['explanation'],
             "recommendations": result['recommendations']
         })
@@ -765,4 +1015,7 @@ def analyze_eye():
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    from gevent.pywsgi import WSGIServer
+
+    print("[INFO] Serving backend on http://0.0.0.0:5000")
+    WSGIServer(("0.0.0.0", 5000), app).serve_forever()
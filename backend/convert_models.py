@@ -0,0 +1,24 @@
+"""
+Convert the Keras .h5 models (brain-tumor UNet and diabetic retinopathy) to TensorFlow SavedModel
+directories. The loaders prefer a SavedModel directory when it exists next to its .h5 file.
+
+Usage (from the backend directory):
+    python convert_models.py
+"""
+from tensorflow import keras
+
+from utils.UNet_2D import SAVED_MODEL_DIR as UNET_SAVED_MODEL_DIR, load_trained_model
+from utils.variables import best_weights_path
+from utils.eye_detection import MODEL_FILE as EYE_MODEL_FILE, SAVED_MODEL_DIR as EYE_SAVED_MODEL_DIR
+
+
+def convert(model, saved_model_dir):
+    """Write a loaded Keras model to saved_model_dir in the TensorFlow SavedModel format."""
+    model.save(saved_model_dir, save_format="tf")
+    print(f"Saved: {saved_model_dir}")
+
+
+if __name__ == "__main__":
+    # Converted from the float32 weights; mixed precision is applied again at load time
+    convert(load_trained_model(best_weights_path), UNET_SAVED_MODEL_DIR)
+    convert(keras.models.load_model(EYE_MODEL_FILE, compile=False), EYE_SAVED_MODEL_DIR)
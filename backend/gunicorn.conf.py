@@ -0,0 +1,18 @@
+"""
+gunicorn settings, picked up automatically by `gunicorn app:app` run from the backend directory.
+"""
+import os
+
+bind = "0.0.0.0:5000"
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+
+# Import the app once in the master before forking; with PRELOAD_MODELS=1 the Keras models are
+# loaded there too and their weights are shared copy-on-write by the workers
+preload_app = True
+
+
+def worker_exit(server, worker):
+    """Write any queued sign-in log rows before the worker process goes away."""
+    from app import drain_signin_logs
+    drain_signin_logs()
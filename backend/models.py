@@ -25,6 +25,7 @@ class SignInLog(Base):
     speciality = Column(String(100), nullable=True)
     ip_address = Column(String(64), nullable=True)
     user_agent = Column(String(512), nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Indexed for time-range queries over the (append-only) log
+    created_at = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
 
 
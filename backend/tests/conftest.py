@@ -0,0 +1,8 @@
+"""
+Shared pytest setup: the backend modules import each other as `utils.*`, so the backend directory
+must be importable when pytest is run from the repository root.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
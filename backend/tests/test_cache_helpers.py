@@ -0,0 +1,42 @@
+"""
+The response cache key must identify a request by its route, its patient files' mtime and its JSON body.
+"""
+from utils.cache_helpers import LRUCache, get_response_cache_key
+
+
+REQUEST = {"patient_path": "/data/BraTS20_Training_009", "modality": "FLAIR", "plane": "Axial", "slice": 80}
+
+
+def test_key_ignores_json_key_order():
+    reordered = dict(reversed(list(REQUEST.items())))
+
+    assert get_response_cache_key("/get_slice", 1, REQUEST) == get_response_cache_key("/get_slice", 1, reordered)
+
+
+def test_key_changes_with_route_mtime_and_body():
+    key = get_response_cache_key("/get_slice", 1, REQUEST)
+
+    assert get_response_cache_key("/get_gif", 1, REQUEST) != key
+    assert get_response_cache_key("/get_slice", 2, REQUEST) != key
+    assert get_response_cache_key("/get_slice", 1, {**REQUEST, "slice": 81}) != key
+    # Values are compared by their JSON form, so a string slice index is a different request
+    assert get_response_cache_key("/get_slice", 1, {**REQUEST, "slice": "80"}) != key
+
+
+def test_key_is_a_fixed_length_hex_digest():
+    key = get_response_cache_key("/get_three_views", 0, {})
+
+    assert len(key) == 32
+    int(key, 16)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert len(cache) == 2
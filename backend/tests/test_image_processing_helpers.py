@@ -0,0 +1,53 @@
+"""
+GIF frames written as GIF_PALETTE indices must look like the RGB overlay they replaced and survive encoding.
+"""
+import base64
+import io
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+from utils.image_processing_helpers import (
+    GIF_PALETTE,
+    encode_gif_base64,
+    normalize_image_slice,
+    overlay_prediction_rgb,
+    pad_to_square,
+    render_gif_frame_indices,
+)
+
+
+def make_slice(seed=0, shape=(240, 155)):
+    rng = np.random.default_rng(seed)
+    slice_img = rng.random(shape, dtype=np.float32) * 900
+    slice_pred = rng.integers(0, 4, size=shape, dtype=np.uint8)
+    return slice_img, slice_pred
+
+
+def test_palette_frame_matches_rgb_overlay():
+    slice_img, slice_pred = make_slice()
+    size = 256
+
+    frame = render_gif_frame_indices(slice_img, slice_pred, size)
+
+    # The former RGB path: same resizes, then the class blend at full gray resolution
+    gray = cv2.resize(pad_to_square(normalize_image_slice(slice_img)), (size, size), interpolation=cv2.INTER_AREA)
+    labels = cv2.resize(pad_to_square(slice_pred), (size, size), interpolation=cv2.INTER_NEAREST)
+    expected = overlay_prediction_rgb(gray, labels)
+
+    assert frame.shape == (size, size)
+    # The palette keeps 64 gray levels, so each channel may be off by the quantization step
+    np.testing.assert_allclose(GIF_PALETTE[frame].astype(np.int16), expected.astype(np.int16), atol=4)
+
+
+def test_gif_encoding_is_lossless():
+    frames = np.stack([render_gif_frame_indices(*make_slice(seed), 64) for seed in range(3)])
+
+    encoded = encode_gif_base64(frames, fps=15)
+
+    with Image.open(io.BytesIO(base64.b64decode(encoded))) as gif:
+        decoded = [np.asarray(frame.convert("RGB")) for frame in ImageSequence.Iterator(gif)]
+    assert len(decoded) == len(frames)
+    for decoded_frame, frame in zip(decoded, frames):
+        np.testing.assert_array_equal(decoded_frame, GIF_PALETTE[frame])
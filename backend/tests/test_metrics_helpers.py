@@ -0,0 +1,37 @@
+"""
+The single-pass bincount voxel counts must agree with the former per-class mask sums.
+"""
+import numpy as np
+import pytest
+
+from utils.metrics_helpers import calculate_class_metrics, calculate_total_tumor_metrics, count_class_voxels
+
+
+@pytest.fixture
+def pred_vol():
+    return np.random.default_rng(0).integers(0, 4, size=(240, 240, 155), dtype=np.uint8)
+
+
+def test_count_class_voxels_matches_mask_sums(pred_vol):
+    counts = count_class_voxels(pred_vol)
+
+    assert counts.tolist() == [int(np.sum(pred_vol == class_id)) for class_id in range(4)]
+
+
+def test_count_class_voxels_keeps_absent_classes():
+    counts = count_class_voxels(np.zeros((8, 8, 8), dtype=np.uint8))
+
+    assert counts.tolist() == [512, 0, 0, 0]
+
+
+def test_metrics_match_mask_sums(pred_vol):
+    voxel_volume_mm3 = 1.5
+    class_metrics = calculate_class_metrics(pred_vol, voxel_volume_mm3)
+    total_metrics = calculate_total_tumor_metrics(pred_vol, voxel_volume_mm3)
+
+    for class_id in (1, 2, 3):
+        class_voxels = int(np.sum(pred_vol == class_id))
+        assert class_metrics[class_id]["voxel_count"] == class_voxels
+        assert class_metrics[class_id]["volume_mm3"] == round(class_voxels * voxel_volume_mm3, 2)
+        assert class_metrics[class_id]["percentage"] == round(class_voxels / pred_vol.size * 100, 2)
+    assert total_metrics["voxel_count"] == int(np.sum(pred_vol > 0))
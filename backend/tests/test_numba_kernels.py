@@ -0,0 +1,53 @@
+"""
+The Numba resize / normalize kernel and its cv2 fallback must match the former per-slice cv2.resize loop.
+"""
+import cv2
+import numpy as np
+import pytest
+
+from utils import numba_kernels
+from utils.numba_kernels import resize_normalize_volume
+
+
+def reference_resize_normalize(flair, t1ce, num_slices, size):
+    """The original predict_segmentation preprocessing: one cv2.resize per slice, then divide by the max."""
+    X = np.empty((num_slices, size, size, 2), dtype=np.float32)
+    for j in range(num_slices):
+        X[j, :, :, 0] = cv2.resize(flair[:, :, j], (size, size))
+        X[j, :, :, 1] = cv2.resize(t1ce[:, :, j], (size, size))
+    return X / np.max(X)
+
+
+def make_volumes(shape, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.random(shape, dtype=np.float32) * 1000, rng.random(shape, dtype=np.float32) * 800
+
+
+@pytest.mark.parametrize("use_numba", [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(not numba_kernels.NUMBA_AVAILABLE, reason="Numba not installed")),
+])
+@pytest.mark.parametrize("shape", [(240, 240, 20), (48, 64, 12)])
+def test_resize_normalize_matches_per_slice_cv2(monkeypatch, use_numba, shape):
+    monkeypatch.setattr(numba_kernels, "NUMBA_AVAILABLE", use_numba)
+    flair, t1ce = make_volumes(shape)
+    num_slices = shape[2] - 2
+
+    result = resize_normalize_volume(flair, t1ce, num_slices, 128)
+
+    assert result.shape == (num_slices, 128, 128, 2)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, reference_resize_normalize(flair, t1ce, num_slices, 128), atol=1e-5)
+
+
+def test_resize_normalize_rejects_too_few_slices():
+    flair, t1ce = make_volumes((32, 32, 10))
+    with pytest.raises(ValueError, match="at least 11 slices"):
+        resize_normalize_volume(flair, t1ce, 11, 16)
+
+
+def test_resize_normalize_rejects_mismatched_modalities():
+    flair, _ = make_volumes((32, 32, 10))
+    _, t1ce = make_volumes((32, 30, 10))
+    with pytest.raises(ValueError, match="differ in shape"):
+        resize_normalize_volume(flair, t1ce, 10, 16)
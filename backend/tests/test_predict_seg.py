@@ -0,0 +1,67 @@
+"""
+Partial-slice segmentation must predict exactly what the full-volume prediction does on those slices.
+"""
+import os
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+from utils import predict_seg
+from utils.variables import VOLUME_SLICES
+
+
+def fake_label_predictor(model):
+    """Stand-in for the UNet: labels depend only on each input slice's own pixels."""
+    def predict_labels(x):
+        x = np.asarray(x, dtype=np.float32)
+        return np.clip((x[..., 0] + 2 * x[..., 1]) * 3, 0, 3).astype(np.uint8)
+    return predict_labels
+
+
+@pytest.fixture
+def patient_root(tmp_path, monkeypatch):
+    """A synthetic patient with random FLAIR / T1CE volumes and every model dependency faked out."""
+    rng = np.random.default_rng(0)
+    root = str(tmp_path / "BraTS20_Training_000")
+    for suffix in ("_flair.nii", "_t1ce.nii"):
+        volume = rng.random((48, 48, VOLUME_SLICES), dtype=np.float32)
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), root + suffix)
+
+    monkeypatch.setattr(predict_seg, "label_predictor", fake_label_predictor)
+    monkeypatch.setattr(predict_seg, "get_predictor_tag", lambda model: "fp32")
+    monkeypatch.setattr(predict_seg, "get_model_source", lambda: str(tmp_path / "model.h5"))
+    monkeypatch.setattr(predict_seg, "LABEL_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(predict_seg, "USE_MIXED_PRECISION", False)
+    monkeypatch.setattr(predict_seg, "INFERENCE_DEVICE", "/CPU:0")
+    # Not a divisor of the slice counts below, so the padding of the last batch is exercised
+    monkeypatch.setattr(predict_seg, "PREDICT_BATCH_SIZE", 16)
+    predict_seg.load_cached_labels.cache_clear()
+    return root
+
+
+@pytest.mark.parametrize("stride", [1, 2, 3])
+def test_partial_prediction_matches_full_prediction(patient_root, stride):
+    slice_indices = list(range(0, VOLUME_SLICES, stride))
+
+    partial = predict_seg.predict_segmentation_labels(object(), patient_root, slice_indices)
+    full = predict_seg.predict_segmentation_labels(object(), patient_root)
+
+    assert full.shape[0] == VOLUME_SLICES
+    np.testing.assert_array_equal(partial, full[slice_indices])
+
+
+def test_partial_prediction_is_served_from_the_full_volume_cache(patient_root):
+    slice_indices = [140, 3, 77]
+    full = predict_seg.predict_segmentation_labels(object(), patient_root)
+
+    cached = predict_seg.predict_segmentation_labels(object(), patient_root, slice_indices)
+
+    np.testing.assert_array_equal(cached, full[slice_indices])
+
+
+def test_partial_prediction_does_not_write_the_cache(patient_root):
+    predict_seg.predict_segmentation_labels(object(), patient_root, [0, 1, 2])
+
+    cache_file = predict_seg.get_label_cache_file(patient_root, "fp32")
+    assert not os.path.exists(cache_file)
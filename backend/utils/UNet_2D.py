@@ -3,7 +3,10 @@ from keras.layers import *
 from keras.models import *
 import keras.backend as K
 import tensorflow as tf
+import functools
 from utils.variables import best_weights_path, IMG_SIZE
+from utils.tf_device import GPUS, INFERENCE_DEVICE
+from utils.UNet_2D_ort import ORTLabelPredictor, load_quantized_unet
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
@@ -37,27 +40,80 @@ def specificity(y_true, y_pred):
 
 # Compute Dice Coef - Measure the overlap between y_true and y_pred
 def dice_coef(y_true, y_pred, smooth=1.0):
-    class_num = 4
-    for i in range(class_num):
-        y_true_f = K.flatten(y_true[:, :, :, i])
-        y_pred_f = K.flatten(y_pred[:, :, :, i])
-        intersection = K.sum(y_true_f * y_pred_f)
-        loss = ((2. * intersection + smooth) / (K.sum(y_true_f) + K.sum(y_pred_f) + smooth))
-        if i == 0:
-            total_loss = loss
-        else:
-            total_loss = total_loss + loss
-    total_loss = total_loss / class_num
-    return total_loss
+    # Per-class sums over batch, height and width in one reduction, then the mean over the 4 classes
+    intersection = K.sum(y_true * y_pred, axis=[0, 1, 2])
+    union = K.sum(y_true, axis=[0, 1, 2]) + K.sum(y_pred, axis=[0, 1, 2])
+    return K.mean((2. * intersection + smooth) / (union + smooth))
+
+
+# Float16 compute only pays off with Tensor Cores; CPU inference stays in float32
+USE_MIXED_PRECISION = bool(GPUS)
+
+
+def to_mixed_precision(model):
+    """Rebuild model with float16 compute / float32 variables, keeping the output (softmax) layer in float32."""
+    config = model.get_config()
+    output_layer = config['layers'][-1]['name']
+    for layer in config['layers']:
+        if layer['class_name'] != 'InputLayer' and layer['name'] != output_layer:
+            layer['config']['dtype'] = 'mixed_float16'
+
+    mixed_model = model.__class__.from_config(config)
+    mixed_model.set_weights(model.get_weights())
+    return mixed_model
+
+
+# SavedModel copy of the trained weights written by convert_models.py; preferred over the .h5 when present
+SAVED_MODEL_DIR = os.path.splitext(best_weights_path)[0] + '_savedmodel'
+
+
+def load_trained_model(model_path):
+    """Load the trained float32 UNet from an .h5 file or a SavedModel directory."""
+    return keras.models.load_model(model_path,
+                                   custom_objects={ 'accuracy' : tf.keras.metrics.MeanIoU(num_classes=4),
+                                                   "dice_coef": dice_coef,
+                                                   "precision": precision,
+                                                   "sensitivity":sensitivity,
+                                                   "specificity":specificity,
+                                                   }, compile=False)
+
+
+def get_model_source():
+    """The SavedModel directory when convert_models.py has written it, otherwise the .h5 weights."""
+    return SAVED_MODEL_DIR if os.path.isdir(SAVED_MODEL_DIR) else best_weights_path
+
 
 def init_model():
     ############ load trained model ################
-    model = keras.models.load_model('C:/Users/Home/OneDrive - Groupe ESAIP/Project-Management/Project-Team5/MedTech-Innovation-Software/MedTech/backend/utils/model_x81_dcs65.h5', 
-                                    custom_objects={ 'accuracy' : tf.keras.metrics.MeanIoU(num_classes=4),
-                                                    "dice_coef": dice_coef,
-                                                    "precision": precision,
-                                                    "sensitivity":sensitivity,
-                                                    "specificity":specificity,
-                                                    }, compile=False)
+    model = load_trained_model(get_model_source())
+    if USE_MIXED_PRECISION:
+        model = to_mixed_precision(model)
+
+    # XLA-compile the predict function (fuses conv + bias + activation kernels)
+    model.compile(jit_compile=True)
     return model
 
+
+@functools.lru_cache(maxsize=None)
+def label_predictor(model):
+    """
+    XLA-compiled forward pass returning uint8 class labels, so only 1 byte/pixel leaves the device.
+    On CPU-only hosts the INT8 ONNX Runtime copy of the model is used instead when available.
+    """
+    if not GPUS:
+        int8_predictor = load_quantized_unet(model, get_model_source())
+        if int8_predictor is not None:
+            return int8_predictor
+
+    @tf.function(jit_compile=True)
+    def predict_labels(x):
+        return tf.cast(tf.argmax(model(x, training=False), axis=-1), tf.uint8)
+
+    return predict_labels
+
+
+def get_predictor_tag(model):
+    """Backend / precision that label_predictor(model) predicts with: int8-ort, mixed_float16 or fp32."""
+    if isinstance(label_predictor(model), ORTLabelPredictor):
+        return "int8-ort"
+    return "mixed_float16" if USE_MIXED_PRECISION else "fp32"
@@ -0,0 +1,73 @@
+"""
+Dynamic INT8 ONNX Runtime copy of the segmentation UNet for CPU inference.
+The Keras model is exported to ONNX and quantized once next to its weights; importers fall back to
+Keras when tf2onnx / ONNX Runtime are unavailable or SEG_INT8=0.
+"""
+
+import os
+import numpy as np
+
+# tf2onnx and ONNX Runtime are optional; without them the Keras model is used
+try:
+    import onnxruntime as ort
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    import tf2onnx
+    import tensorflow as tf
+    ORT_AVAILABLE = True
+except Exception:
+    ORT_AVAILABLE = False
+
+# Set SEG_INT8=0 to keep the float32 Keras UNet (e.g. when the INT8 Dice regresses on new weights)
+INT8_ENABLED = os.environ.get("SEG_INT8", "1") != "0"
+ONNX_OPSET = 15
+
+
+class ORTLabelPredictor:
+    """CPU ONNX Runtime session returning uint8 class labels, a drop-in for UNet_2D.label_predictor."""
+
+    def __init__(self, model_file: str):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self._input_name = self._session.get_inputs()[0].name
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Run a (batch, IMG_SIZE, IMG_SIZE, 2) float32 batch and return (batch, IMG_SIZE, IMG_SIZE) labels."""
+        probabilities = self._session.run(None, {self._input_name: x})[0]
+        return np.argmax(probabilities, axis=-1).astype(np.uint8)
+
+
+def export_onnx(keras_model, onnx_file: str) -> None:
+    """Convert the float32 Keras UNet to ONNX with a dynamic batch dimension."""
+    input_shape = (None,) + tuple(keras_model.input_shape[1:])
+    input_signature = (tf.TensorSpec(input_shape, tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=input_signature, opset=ONNX_OPSET, output_path=onnx_file)
+
+
+def load_quantized_unet(keras_model, source_file: str):
+    """
+    Return an ORTLabelPredictor for the INT8 copy of keras_model, or None when it cannot be used.
+    The quantized model is cached next to source_file and rebuilt when source_file is newer.
+    """
+    if not (ORT_AVAILABLE and INT8_ENABLED):
+        return None
+
+    base_path = os.path.splitext(os.path.normpath(source_file))[0]
+    onnx_file = base_path + ".onnx"
+    quantized_file = base_path + "_int8.onnx"
+
+    try:
+        is_fresh = (
+            os.path.exists(quantized_file)
+            and os.path.getmtime(quantized_file) >= os.path.getmtime(source_file)
+        )
+        if not is_fresh:
+            print("Exporting and INT8-quantizing the segmentation model with ONNX Runtime...")
+            export_onnx(keras_model, onnx_file)
+            quantize_dynamic(onnx_file, quantized_file, weight_type=QuantType.QInt8)
+            print(f"Quantized segmentation model saved to: {quantized_file}")
+
+        return ORTLabelPredictor(quantized_file)
+    except Exception as e:
+        print(f"Warning: INT8 ONNX Runtime segmentation model unavailable, using Keras: {e}")
+        return None
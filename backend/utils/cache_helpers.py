@@ -0,0 +1,68 @@
+"""
+Helper functions and containers for in-process caching shared by the routes.
+"""
+import glob
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+class LRUCache:
+    """Thread-safe least-recently-used mapping with a bounded size."""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key (marking it as recently used) or default."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store value under key, evicting the least recently used entries if needed."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for key, computing and storing it on a miss."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            # Computed outside the lock so a slow miss does not block other keys
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        """Drop every cached entry."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+def get_files_mtime_ns(pattern: str) -> int:
+    """Return the most recent modification time (ns) of the files matching pattern."""
+    return max((os.stat(path).st_mtime_ns for path in glob.glob(pattern)), default=0)
+
+
+def get_response_cache_key(route: str, mtime_ns: int, data: Dict[str, Any]) -> str:
+    """
+    BLAKE2b digest of a route, its patient files' mtime and its JSON body.
+    The body is serialized with sorted keys, so the same request always maps to the same key.
+    """
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.blake2b(f"{route}\0{mtime_ns}\0{body}".encode("utf-8"), digest_size=16).hexdigest()
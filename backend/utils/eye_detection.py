@@ -3,10 +3,13 @@ Diabetic Retinopathy Detection Module
 Handles loading and using a Keras/TensorFlow model for diabetic retinopathy detection.
 """
 
+import functools
 import os
 import numpy as np
 import cv2
 from PIL import Image
+from utils.image_processing_helpers import encode_jpeg_base64
+from utils.eye_detection_trt import load_trt_engine
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -14,6 +17,7 @@ warnings.filterwarnings('ignore')
 try:
     import tensorflow as tf
     from tensorflow import keras
+    from utils.tf_device import INFERENCE_DEVICE
 except ImportError:
     raise ImportError("TensorFlow is not installed. Please install it with: pip install tensorflow")
 
@@ -47,9 +51,16 @@ CLASS_DISPLAY_NAMES = {
 # Model configuration
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "model", "diabetic-retinopathy")
 MODEL_FILE = os.path.join(MODEL_PATH, "best_model.h5")
+# SavedModel copy written by convert_models.py; preferred over the .h5 when present
+SAVED_MODEL_DIR = os.path.join(MODEL_PATH, "best_model_savedmodel")
 
-# Global model variable
+# Decode directly to RGB where OpenCV supports it, otherwise decode BGR and convert
+IMREAD_FLAG = getattr(cv2, "IMREAD_COLOR_RGB", cv2.IMREAD_COLOR)
+
+# Global model variables
 eye_model = None
+eye_infer = None
+eye_trt_engine = None
 
 
 def preprocess_image(image_file):
@@ -62,59 +73,59 @@ def preprocess_image(image_file):
     Returns:
         Preprocessed image array (384, 384, 3) and original image
     """
-    # Read image
+    # Read image (OpenCV >= 4.10 can decode straight to RGB)
     if isinstance(image_file, str):
         # If it's a file path
-        img = cv2.imread(image_file)
+        img = cv2.imread(image_file, IMREAD_FLAG)
         if img is None:
             raise ValueError(f"Could not read image from path: {image_file}")
     else:
         # If it's a file object
         image_file.seek(0)
         img_array = np.frombuffer(image_file.read(), np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+        img = cv2.imdecode(img_array, IMREAD_FLAG)
         if img is None:
             raise ValueError("Could not decode image from file object")
     
-    # Convert BGR to RGB
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    # Resize to (384, 384)
+    # Resize to (384, 384) first so the color conversion only touches the small image
     img = cv2.resize(img, (384, 384))
-    
-    # Normalize to [0, 1]
-    img = img.astype(np.float32) / 255.0
+    if IMREAD_FLAG == cv2.IMREAD_COLOR:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     
     # Store original for heatmap generation
-    img_original = (img * 255).astype(np.uint8)
+    img_original = img
+    
+    # Normalize to [0, 1]
+    img = img_original.astype(np.float32) * np.float32(1 / 255.0)
     
     return img, img_original
 
 
 def load_eye_model():
-    """Load the Keras/TensorFlow model from .h5 file."""
-    global eye_model
+    """Load the Keras/TensorFlow model from its SavedModel directory or .h5 file."""
+    global eye_model, eye_infer, eye_trt_engine
     
     if eye_model is None:
         try:
-            if not os.path.exists(MODEL_FILE):
+            model_source = SAVED_MODEL_DIR if os.path.isdir(SAVED_MODEL_DIR) else MODEL_FILE
+            if not os.path.exists(model_source):
                 raise FileNotFoundError(
                     f"Model file not found. Expected:\n"
                     f"  - {MODEL_FILE}\n"
                     f"Please ensure the model file exists in the model directory."
                 )
             
-            print(f"Loading diabetic retinopathy model from: {MODEL_FILE}")
+            print(f"Loading diabetic retinopathy model from: {model_source}")
             
             # Load Keras model
             # Try loading with custom_objects if needed
             try:
-                eye_model = keras.models.load_model(MODEL_FILE, compile=False)
+                eye_model = keras.models.load_model(model_source, compile=False)
             except Exception as e:
                 print(f"Warning: Standard load failed: {e}")
                 print("Trying to load with safe_mode=False...")
                 try:
-                    eye_model = keras.models.load_model(MODEL_FILE, compile=False, safe_mode=False)
+                    eye_model = keras.models.load_model(model_source, compile=False, safe_mode=False)
                 except Exception as e2:
                     print(f"Warning: Safe mode load failed: {e2}")
                     # Last resort: try loading weights only
@@ -124,6 +135,16 @@ def load_eye_model():
             print(f"Model input shape: {eye_model.input_shape}")
             print(f"Model output shape: {eye_model.output_shape}")
             
+            # Trace the forward pass once for the fixed input signature, skipping
+            # model.predict's per-call data pipeline and retracing
+            eye_infer = tf.function(
+                lambda x: eye_model(x, training=False),
+                input_signature=[tf.TensorSpec((1, 384, 384, 3), tf.float32)],
+            ).get_concrete_function()
+            
+            # Optional TensorRT FP16 engine; None keeps inference on Keras
+            eye_trt_engine = load_trt_engine(eye_model, model_source)
+            
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -132,6 +153,40 @@ def load_eye_model():
     return eye_model
 
 
+@functools.lru_cache(maxsize=32)
+def radial_heatmap(height, width, severity_level):
+    """
+    Build the colored (RGB uint8) radial heatmap for an image size and severity level (0-4).
+    Cached, since it does not depend on the image content.
+    """
+    center_y, center_x = height // 2, width // 2
+    
+    # Create radial gradient based on severity level
+    y, x = np.ogrid[:height, :width]
+    radius = min(height, width) // 3
+    distance = np.sqrt((x - center_x)**2 + (y - center_y)**2)
+    
+    # Intensity increases with severity (0-4)
+    intensity = (severity_level + 1) / 5.0
+    heatmap = np.exp(-distance / (radius * (2 - intensity)))
+    heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min() + 1e-8)
+    
+    # Convert to colored heatmap
+    heatmap_uint8 = (heatmap * 255).astype(np.uint8)
+    heatmap_colored = cv2.applyColorMap(heatmap_uint8, cv2.COLORMAP_JET)
+    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+    
+    # Shared between requests, so guard against in-place edits
+    heatmap_colored.setflags(write=False)
+    return heatmap_colored
+
+
+@functools.lru_cache(maxsize=32)
+def radial_heatmap_jpeg(height, width, severity_level):
+    """Return the base64 JPEG of radial_heatmap for an image size and severity level."""
+    return encode_jpeg_base64(radial_heatmap(height, width, severity_level))
+
+
 def predict_dr_severity(image_file):
     """
     Predict diabetic retinopathy severity from an image (0-4 scale).
@@ -150,7 +205,11 @@ def predict_dr_severity(image_file):
         img_batch = np.expand_dims(img_preprocessed, axis=0)
         
         # Make prediction
-        predictions = model.predict(img_batch, verbose=0)
+        if eye_trt_engine is not None:
+            predictions = eye_trt_engine.predict(img_batch)
+        else:
+            with tf.device(INFERENCE_DEVICE):
+                predictions = eye_infer(tf.constant(img_batch)).numpy()
         
         # Get predicted class index
         predicted_idx = int(np.argmax(predictions, axis=1)[0])
@@ -171,33 +230,12 @@ def predict_dr_severity(image_file):
         # Get result type based on severity
         result_type = SEVERITY_TO_RESULT.get(predicted_idx, "Normal")
         
-        # Generate simple heatmap (centered on image)
+        # Generate simple heatmap (centered on image); it only depends on the image size and severity
         original_height, original_width = img_original.shape[:2]
+        heatmap_colored = radial_heatmap(original_height, original_width, predicted_idx)
         
-        # Create a simple heatmap based on severity (higher severity = more intense)
-        heatmap = np.zeros((original_height, original_width), dtype=np.float32)
-        center_y, center_x = original_height // 2, original_width // 2
-        
-        # Create radial gradient based on severity level
-        y, x = np.ogrid[:original_height, :original_width]
-        radius = min(original_height, original_width) // 3
-        distance = np.sqrt((x - center_x)**2 + (y - center_y)**2)
-        
-        # Intensity increases with severity (0-4)
-        intensity = (predicted_idx + 1) / 5.0
-        heatmap = np.exp(-distance / (radius * (2 - intensity)))
-        heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min() + 1e-8)
-        
-        # Convert to colored heatmap
-        heatmap_uint8 = (heatmap * 255).astype(np.uint8)
-        heatmap_colored = cv2.applyColorMap(heatmap_uint8, cv2.COLORMAP_JET)
-        heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
-        
-        # Overlay heatmap on original image
-        img_original_float = img_original.astype(np.float32) / 255.0
-        heatmap_float = heatmap_colored.astype(np.float32) / 255.0
-        overlay = cv2.addWeighted(img_original_float, 0.7, heatmap_float, 0.3, 0)
-        overlay_uint8 = (overlay * 255).astype(np.uint8)
+        # Overlay heatmap on original image (saturating uint8 blend, no float round trip)
+        overlay_uint8 = cv2.addWeighted(img_original, 0.7, heatmap_colored, 0.3, 0)
         
         # Calculate metrics
         model_precision = float(confidence * 100)
@@ -231,8 +269,8 @@ def predict_dr_severity(image_file):
                 }
             ],
             "all_predictions": all_predictions,
-            "heatmap": overlay_uint8,
-            "heatmap_raw": heatmap_colored,
+            "heatmap": encode_jpeg_base64(overlay_uint8),
+            "heatmap_raw": radial_heatmap_jpeg(original_height, original_width, predicted_idx),
             "explanation": explanation,
             "recommendations": recommendations
         }
@@ -0,0 +1,133 @@
+"""
+TensorRT FP16 engine for the diabetic retinopathy model.
+Converts the Keras model to ONNX once, builds (and caches) a TensorRT engine, and runs inference
+through a persistent execution context on PyTorch's CUDA stream and device buffers (the same CUDA
+primary context TensorFlow uses, created only when an engine is loaded). Importers fall back to
+Keras when TensorRT is unavailable.
+"""
+
+import os
+import threading
+import numpy as np
+
+# TensorRT, PyTorch (CUDA buffers) and tf2onnx are optional; without them the Keras model is used
+try:
+    import tensorrt as trt
+    import torch
+    import tf2onnx
+    import tensorflow as tf
+    TRT_AVAILABLE = torch.cuda.is_available()
+except Exception:
+    TRT_AVAILABLE = False
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "model", "diabetic-retinopathy")
+ONNX_FILE = os.path.join(MODEL_PATH, "best_model.onnx")
+ENGINE_FILE = os.path.join(MODEL_PATH, "best_model_fp16.plan")
+
+# Same input resolution as eye_detection.preprocess_image
+IMG_SIZE = 384
+ONNX_OPSET = 15
+WORKSPACE_BYTES = 1 << 30
+
+
+class TRTEyeEngine:
+    """Persistent TensorRT execution context with pinned host and static device buffers for a batch of one."""
+
+    def __init__(self, serialized_engine: bytes):
+        self._logger = trt.Logger(trt.Logger.WARNING)
+        self._runtime = trt.Runtime(self._logger)
+        self._engine = self._runtime.deserialize_cuda_engine(serialized_engine)
+        self._context = self._engine.create_execution_context()
+        # An execution context must not be used by two requests at once
+        self._lock = threading.Lock()
+
+        tensor_names = [self._engine.get_tensor_name(i) for i in range(self._engine.num_io_tensors)]
+        self._input_name = next(
+            name for name in tensor_names if self._engine.get_tensor_mode(name) == trt.TensorIOMode.INPUT
+        )
+        self._output_name = next(
+            name for name in tensor_names if self._engine.get_tensor_mode(name) == trt.TensorIOMode.OUTPUT
+        )
+        input_shape = tuple(self._engine.get_tensor_shape(self._input_name))
+        output_shape = tuple(self._engine.get_tensor_shape(self._output_name))
+        self._host_in = torch.empty(input_shape, dtype=torch.float32).pin_memory()
+        self._host_out = torch.empty(output_shape, dtype=torch.float32).pin_memory()
+        self._device_in = torch.empty(input_shape, dtype=torch.float32, device="cuda")
+        self._device_out = torch.empty(output_shape, dtype=torch.float32, device="cuda")
+        self._context.set_tensor_address(self._input_name, self._device_in.data_ptr())
+        self._context.set_tensor_address(self._output_name, self._device_out.data_ptr())
+
+    def predict(self, img_batch: np.ndarray) -> np.ndarray:
+        """Run a (1, 384, 384, 3) float32 batch and return the (1, num_classes) probabilities."""
+        with self._lock:
+            self._host_in.numpy()[...] = img_batch
+            stream = torch.cuda.current_stream()
+            # Copies and the engine are queued on the same stream, so they run in order
+            self._device_in.copy_(self._host_in, non_blocking=True)
+            if not self._context.execute_async_v3(stream.cuda_stream):
+                raise RuntimeError("TensorRT inference failed")
+            self._host_out.copy_(self._device_out, non_blocking=True)
+            stream.synchronize()
+            return self._host_out.numpy().copy()
+
+
+def export_onnx(keras_model, onnx_file: str = ONNX_FILE) -> None:
+    """Convert the Keras model to ONNX with a fixed batch-of-one input signature."""
+    input_signature = (tf.TensorSpec((1, IMG_SIZE, IMG_SIZE, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=input_signature, opset=ONNX_OPSET, output_path=onnx_file)
+
+
+def build_engine(onnx_file: str = ONNX_FILE) -> bytes:
+    """Build a serialized TensorRT engine from the ONNX file, using FP16 kernels where supported."""
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, logger)
+
+    with open(onnx_file, "rb") as f:
+        if not parser.parse(f.read()):
+            errors = "\n".join(str(parser.get_error(i)) for i in range(parser.num_errors))
+            raise RuntimeError(f"Failed to parse ONNX model:\n{errors}")
+
+    config = builder.create_builder_config()
+    config.set_memory_pool_limit(trt.MemoryPoolType.WORKSPACE, WORKSPACE_BYTES)
+    if builder.platform_has_fast_fp16:
+        config.set_flag(trt.BuilderFlag.FP16)
+
+    serialized_engine = builder.build_serialized_network(network, config)
+    if serialized_engine is None:
+        raise RuntimeError("TensorRT engine build failed")
+    return bytes(serialized_engine)
+
+
+def load_trt_engine(keras_model, source_file: str):
+    """
+    Return a TRTEyeEngine for keras_model, or None when TensorRT cannot be used.
+    The engine plan is cached next to the model and rebuilt when source_file is newer.
+    """
+    if not TRT_AVAILABLE:
+        return None
+
+    try:
+        plan_is_fresh = (
+            os.path.exists(ENGINE_FILE)
+            and os.path.getmtime(ENGINE_FILE) >= os.path.getmtime(source_file)
+        )
+        if plan_is_fresh:
+            with open(ENGINE_FILE, "rb") as f:
+                serialized_engine = f.read()
+        else:
+            print("Building TensorRT FP16 engine for the diabetic retinopathy model...")
+            export_onnx(keras_model)
+            serialized_engine = build_engine()
+            with open(ENGINE_FILE, "wb") as f:
+                f.write(serialized_engine)
+            print(f"TensorRT engine saved to: {ENGINE_FILE}")
+
+        engine = TRTEyeEngine(serialized_engine)
+        # Run once here, so an engine that cannot execute falls back to Keras at load time
+        engine.predict(np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32))
+        return engine
+    except Exception as e:
+        print(f"Warning: TensorRT engine unavailable, using Keras: {e}")
+        return None
@@ -12,13 +12,13 @@ from utils.variables import data_path, samples_test, modalities_dict
 from utils.img_processing import (
     modality_and_ground_truth_processing,
     predicted_seg_processing,
-    resize_predicted_seg,
 )
-from utils.predict_seg import patient_has_changed_update_token, get_selected_patient_path, predict_btn_click
+from utils.predict_seg import patient_has_changed_update_token, get_selected_patient_path, predict_segmentation_labels
+from utils.image_processing_helpers import create_slicer_function, get_jet_class_lut, resize_label_volume
 
 
+import functools
 import nibabel as nib
-import matplotlib.pyplot as plt
 import numpy as np
 import base64
 import io
@@ -45,29 +45,51 @@ def get_modality_file(patient_path, modality):
 
     return file_path
 
-def get_gif(patient_path, modality, plane):
-     # Load modality volume
+_model = None
+
+
+def get_model():
+    """Load the segmentation model on first use."""
+    global _model
+    if _model is None:
+        _model = init_model()
+    return _model
+
+
+def load_patient(patient_path, modality):
+    """
+    Load a modality volume and the predicted label volume once per (patient, modality, file mtime),
+    so the three planes of a patient share one decode and one prediction and a re-upload invalidates them.
+    """
     modality_file = get_modality_file(patient_path, modality)
-    img = nib.load(modality_file).get_fdata()  # (H, W, Z)
+    return _load_patient(patient_path, modality, os.stat(modality_file).st_mtime_ns)
+
 
-    # Compute / retrieve model prediction once per patient
+@functools.lru_cache(maxsize=8)
+def _load_patient(patient_path, modality, mtime_ns):
+    """Decode and predict one (patient, modality) pair; mtime_ns only keys the cache."""
+    # Load modality volume (float32 avoids the float64 upcast of get_fdata)
+    modality_file = get_modality_file(patient_path, modality)
+    img = nib.load(modality_file).get_fdata(dtype=np.float32)  # (H, W, Z)
+
+    # Predict this patient directly (not through SESSION_STATE, which may still hold another patient's)
     patient_name = os.path.basename(os.path.normpath(patient_path))
     patient_root = os.path.join(patient_path, patient_name)
-    pred_raw = predict_btn_click(model, patient_root)              # (155, IMG_SIZE, IMG_SIZE, 4)
-    pred_resized = resize_predicted_seg(pred_raw)                  # (155, 240, 240, 4)
-    pred_classes = np.argmax(pred_resized, axis=3).astype(np.int16)  # (155, 240, 240)
-    pred_vol = np.moveaxis(pred_classes, 0, 2)                     # (240, 240, 155) like nib layout
+    pred_labels = predict_segmentation_labels(get_model(), patient_root)  # (155, IMG_SIZE, IMG_SIZE) uint8
+    pred_vol = np.ascontiguousarray(pred_labels.transpose(1, 2, 0))      # (IMG_SIZE, IMG_SIZE, 155) like nib layout
+    pred_vol = resize_label_volume(pred_vol, (240, 240, pred_vol.shape[2]))
+
+    # Cached arrays are shared between calls, so guard them against in-place edits
+    img.setflags(write=False)
+    pred_vol.setflags(write=False)
+    return img, pred_vol
+
+
+def get_gif(patient_path, modality, plane):
+    img, pred_vol = load_patient(patient_path, modality)
 
     # Choose slicing axis based on plane
-    if plane == "Axial":
-        num_slices = img.shape[2]
-        slicer = lambda i: (img[:, :, i], pred_vol[:, :, i])
-    elif plane == "Sagittal":
-        num_slices = img.shape[0]
-        slicer = lambda i: (np.rot90(img[i, :, :]), np.rot90(pred_vol[i, :, :]))
-    else:  # Coronal
-        num_slices = img.shape[1]
-        slicer = lambda i: (np.rot90(img[:, i, :]), np.rot90(pred_vol[:, i, :]))
+    num_slices, slicer = create_slicer_function(img, pred_vol, plane)
 
     # Sample slices (more frames => slower sweep).
     # Axial can move a bit faster; sagittal/coronal get more frames for smoother, slower motion.
@@ -86,21 +108,22 @@ def get_gif(patient_path, modality, plane):
     for idx in idxs:
         slice_img, slice_gt = slicer(idx)
 
-        fig, ax = plt.subplots(figsize=(4, 4), facecolor="black")
-        ax.set_facecolor("black")
-        ax.imshow(slice_img, cmap="gray")
-        mask_show = np.ma.masked_where(slice_gt == 0, slice_gt)
-        ax.imshow(mask_show, cmap="jet", alpha=0.4, interpolation="none")
-        ax.axis("off")
-        plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
-        fig.canvas.draw()
+        # Composite directly with OpenCV rather than rasterizing a matplotlib figure per slice
+        gray = cv2.normalize(np.ascontiguousarray(slice_img), None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        frame = cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+        mask = slice_gt > 0
+        if mask.any():
+            # Same colors as the former imshow(cmap="jet", alpha=0.4) of the masked labels
+            labels = np.ascontiguousarray(slice_gt).astype(np.uint8)
+            present = labels[mask]
+            mask_rgb = get_jet_class_lut(int(present.min()), int(present.max()))[labels]
+            blended = cv2.addWeighted(frame, 0.6, mask_rgb, 0.4, 0)
+            frame[mask] = blended[mask]
 
-        frame = np.asarray(fig.canvas.renderer.buffer_rgba())[..., :3]
         # Resize every frame to the same resolution for perfectly smooth animation
-        frame = cv2.resize(frame, (target_w, target_h))
+        frame = cv2.resize(frame, (target_w, target_h), interpolation=cv2.INTER_AREA)
 
         frames.append(frame)
-        plt.close(fig)
 
     if len(frames) == 0:
         return jsonify({
@@ -111,7 +134,7 @@ def get_gif(patient_path, modality, plane):
     gif_bytes = io.BytesIO()
     # loop=0 → infinite looping GIF
     imageio.mimsave(gif_bytes, frames, format="GIF", fps=fps, loop=0)
-    gif_bytes.seek(0)
-    encoded_gif = base64.b64encode(gif_bytes.read()).decode("utf-8")
+    # getbuffer() is a zero-copy view of the encoded GIF
+    encoded_gif = base64.b64encode(gif_bytes.getbuffer()).decode("utf-8")
 
     return jsonify({"gif": encoded_gif})
\ No newline at end of file
@@ -1,11 +1,23 @@
 """
 Helper functions for image processing operations used across multiple routes.
 """
+import base64
+import functools
+import io
 import numpy as np
 import cv2
+from PIL import Image
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
-from typing import Tuple, Callable
+from typing import Tuple, Callable, List
+from utils.numba_kernels import NUMBA_AVAILABLE, normalize_slice_u8, filter_class
+
+# libjpeg-turbo bindings are optional; OpenCV's encoder is used when they are unavailable
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbo_jpeg = TurboJPEG()
+except Exception:
+    _turbo_jpeg = None
 
 CLASS_COLOR_MAP = {
     1: "#f6a9c4",  # Non-enhancing tumor
@@ -13,11 +25,58 @@ CLASS_COLOR_MAP = {
     3: "#8abed8",  # Enhancing tumor
 }
 
+# Quality of the JPEG heatmaps returned by the detection endpoints
+JPEG_QUALITY = 85
+
+# Opacity of the segmentation overlay drawn on top of the grayscale slice
+OVERLAY_ALPHA = 0.75
+
+# OpenCV's per-image channel limit (CV_CN_MAX)
+CV_MAX_CHANNELS = 512
+
+# RGB lookup table indexed by class id (background row is unused)
+CLASS_COLOR_LUT = np.zeros((4, 3), dtype=np.uint8)
+for _class_id, _hex_color in CLASS_COLOR_MAP.items():
+    CLASS_COLOR_LUT[_class_id] = [int(_hex_color[i:i + 2], 16) for i in (1, 3, 5)]
+
+# GIF frames are written directly as palette indices: class_id * GIF_GRAY_LEVELS + gray level
+GIF_GRAY_LEVELS = 64
+_gif_gray = np.linspace(0, 255, GIF_GRAY_LEVELS, dtype=np.float32)[:, None].repeat(3, axis=1)
+GIF_PALETTE = np.concatenate([
+    _gif_gray if class_id == 0
+    else (1 - OVERLAY_ALPHA) * _gif_gray + OVERLAY_ALPHA * CLASS_COLOR_LUT[class_id].astype(np.float32)
+    for class_id in range(4)
+]).astype(np.uint8)
+
 
 def normalize_image_slice(slice_data: np.ndarray) -> np.ndarray:
     """Normalize image slice to 0-255 range for display."""
-    slice_data = np.nan_to_num(slice_data)
-    return ((slice_data - slice_data.min()) / (slice_data.max() - slice_data.min() + 1e-8) * 255).astype(np.uint8)
+    return normalize_image_slices([slice_data])[0]
+
+
+def normalize_image_slices(slices: List[np.ndarray]) -> List[np.ndarray]:
+    """Normalize several slices to 0-255, with one Numba pass per slice or one batched NumPy pass per shape."""
+    if NUMBA_AVAILABLE:
+        return [normalize_slice_u8(slice_data) for slice_data in slices]
+
+    normalized = [None] * len(slices)
+    indices_by_shape = {}
+    for i, slice_data in enumerate(slices):
+        indices_by_shape.setdefault(slice_data.shape, []).append(i)
+
+    for indices in indices_by_shape.values():
+        # np.stack copies the (possibly strided) views once; everything after runs in place
+        stack = np.stack([slices[i] for i in indices]).astype(np.float32, copy=False)
+        np.nan_to_num(stack, copy=False)
+        lo = stack.min(axis=(1, 2), keepdims=True)
+        hi = stack.max(axis=(1, 2), keepdims=True)
+        stack -= lo
+        stack *= 255 / (hi - lo + 1e-8)
+        stack = stack.astype(np.uint8)
+        for k, i in enumerate(indices):
+            normalized[i] = stack[k]
+
+    return normalized
 
 
 def filter_prediction_by_class(pred_slice: np.ndarray, selected_class: str) -> np.ndarray:
@@ -28,11 +87,14 @@ def filter_prediction_by_class(pred_slice: np.ndarray, selected_class: str) -> n
         return np.zeros_like(pred_slice)
     else:
         class_value = int(selected_class)
+        if pred_slice.ndim == 2:
+            return filter_class(pred_slice, class_value)
         return np.where(pred_slice == class_value, pred_slice, 0)
 
 
+@functools.lru_cache(maxsize=None)
 def create_segmentation_colormap() -> Tuple[mcolors.ListedColormap, mcolors.BoundaryNorm]:
-    """Create colormap and normalization for segmentation overlay."""
+    """Create colormap and normalization for segmentation overlay (built once and shared, do not modify)."""
     multi_cmap = mcolors.ListedColormap(
         ["#00000000", CLASS_COLOR_MAP[1], CLASS_COLOR_MAP[2], CLASS_COLOR_MAP[3]]
     )
@@ -40,6 +102,20 @@ def create_segmentation_colormap() -> Tuple[mcolors.ListedColormap, mcolors.Boun
     return multi_cmap, multi_norm
 
 
+@functools.lru_cache(maxsize=None)
+def get_jet_class_lut(vmin: int, vmax: int) -> np.ndarray:
+    """
+    4x3 uint8 RGB lookup table coloring labels 0-3 with matplotlib's "jet" normalized to [vmin, vmax],
+    as imshow(cmap="jet") autoscales to the labels present in a masked slice (vmin == vmax maps to jet(0)).
+    Built once per range and shared read-only.
+    """
+    labels = np.arange(4, dtype=np.float32)
+    scaled = (labels - vmin) / (vmax - vmin) if vmax > vmin else np.zeros_like(labels)
+    lut = np.ascontiguousarray(plt.get_cmap("jet")(np.clip(scaled, 0.0, 1.0), bytes=True)[:, :3])
+    lut.setflags(write=False)
+    return lut
+
+
 def extract_slice_by_plane(img: np.ndarray, pred_vol: np.ndarray, plane: str, slice_idx: int) -> Tuple[np.ndarray, np.ndarray]:
     """Extract image and prediction slices based on plane and index."""
     if plane == "Axial":
@@ -64,26 +140,45 @@ def extract_slice_by_plane(img: np.ndarray, pred_vol: np.ndarray, plane: str, sl
     # Ensure shapes match
     if slice_pred.shape != slice_img.shape:
         slice_pred = cv2.resize(
-            slice_pred.astype(np.float32),
+            np.ascontiguousarray(slice_pred),
             (slice_img.shape[1], slice_img.shape[0]),
             interpolation=cv2.INTER_NEAREST
-        ).astype(np.int16)
+        )
     
     return slice_img, slice_pred
 
 
+def resize_label_volume(label_vol: np.ndarray, target_shape: Tuple[int, int, int]) -> np.ndarray:
+    """Nearest-neighbor resize of an (H, W, Z) label volume, treating slices as channels."""
+    target_h, target_w, target_z = target_shape
+    depth = min(label_vol.shape[2], target_z)
+    resized = np.zeros(target_shape, dtype=label_vol.dtype)
+
+    # One cv2.resize call handles up to CV_MAX_CHANNELS slices at once
+    for start in range(0, depth, CV_MAX_CHANNELS):
+        stop = min(start + CV_MAX_CHANNELS, depth)
+        chunk = np.ascontiguousarray(label_vol[:, :, start:stop])
+        chunk = cv2.resize(chunk, (target_w, target_h), interpolation=cv2.INTER_NEAREST)
+        resized[:, :, start:stop] = chunk.reshape(target_h, target_w, stop - start)
+
+    return resized
+
+
 def create_slicer_function(img: np.ndarray, pred_vol: np.ndarray, plane: str) -> Tuple[int, Callable]:
     """Create a slicer function for GIF generation based on plane."""
+    # Rotate (or transpose) each volume once so every frame is a plain leading-axis index
     if plane == "Axial":
-        num_slices = img.shape[2]
-        slicer = lambda i: (img[:, :, i], pred_vol[:, :, i])
+        img_view, pred_view = img.transpose(2, 0, 1), pred_vol.transpose(2, 0, 1)
     elif plane == "Sagittal":
-        num_slices = img.shape[0]
-        slicer = lambda i: (np.rot90(img[i, :, :]), np.rot90(pred_vol[i, :, :]))
+        # np.rot90(vol, axes=(1, 2))[i] == np.rot90(vol[i, :, :])
+        img_view, pred_view = np.rot90(img, axes=(1, 2)), np.rot90(pred_vol, axes=(1, 2))
     else:  # Coronal
-        num_slices = img.shape[1]
-        slicer = lambda i: (np.rot90(img[:, i, :]), np.rot90(pred_vol[:, i, :]))
+        # np.rot90(vol, axes=(0, 2)).swapaxes(0, 1)[i] == np.rot90(vol[:, i, :])
+        img_view = np.rot90(img, axes=(0, 2)).swapaxes(0, 1)
+        pred_view = np.rot90(pred_vol, axes=(0, 2)).swapaxes(0, 1)
     
+    num_slices = img_view.shape[0]
+    slicer = lambda i: (img_view[i], pred_view[i])
     return num_slices, slicer
 
 
@@ -123,3 +218,92 @@ def render_slice_with_overlay(
     
     return fig
 
+
+def render_slice_with_overlay_array(slice_img: np.ndarray, slice_pred: np.ndarray) -> np.ndarray:
+    """Composite a slice and its prediction overlay into an HxWx3 uint8 RGB array."""
+    return overlay_prediction_rgb(normalize_image_slice(slice_img), slice_pred)
+
+
+def overlay_prediction_rgb(gray: np.ndarray, slice_pred: np.ndarray) -> np.ndarray:
+    """Blend the class colors of a prediction slice over an already normalized uint8 slice, as HxWx3 RGB."""
+    image_rgb = cv2.cvtColor(np.ascontiguousarray(gray), cv2.COLOR_GRAY2RGB)
+
+    mask = slice_pred > 0
+    if mask.any():
+        colors = CLASS_COLOR_LUT[slice_pred[mask]].astype(np.float32)
+        blended = (1 - OVERLAY_ALPHA) * image_rgb[mask] + OVERLAY_ALPHA * colors
+        image_rgb[mask] = blended.astype(np.uint8)
+
+    return image_rgb
+
+
+def pad_to_square(image: np.ndarray) -> np.ndarray:
+    """Pad an image with black borders so it is centered in a square canvas."""
+    h, w = image.shape[:2]
+    size = max(h, w)
+    top, left = (size - h) // 2, (size - w) // 2
+    return cv2.copyMakeBorder(
+        image, top, size - h - top, left, size - w - left, cv2.BORDER_CONSTANT, value=0
+    )
+
+
+def render_gif_frame_indices(slice_img: np.ndarray, slice_pred: np.ndarray, size: int = 256) -> np.ndarray:
+    """
+    Composite a slice and its prediction into a size x size frame of GIF_PALETTE indices.
+    The grayscale is downsampled with INTER_AREA and the labels with INTER_NEAREST so classes never blend.
+    """
+    gray = cv2.resize(pad_to_square(normalize_image_slice(slice_img)), (size, size), interpolation=cv2.INTER_AREA)
+    labels = cv2.resize(
+        pad_to_square(np.asarray(slice_pred, dtype=np.uint8)), (size, size), interpolation=cv2.INTER_NEAREST
+    )
+    return (gray >> 2) + labels * np.uint8(GIF_GRAY_LEVELS)
+
+
+def encode_gif_base64(frames: np.ndarray, fps: float) -> str:
+    """Encode (N, H, W) GIF_PALETTE index frames as a looping base64 GIF string."""
+    images = [Image.fromarray(frame, mode="P") for frame in frames]
+    for image in images:
+        image.putpalette(GIF_PALETTE.tobytes())
+
+    buf = io.BytesIO()
+    images[0].save(
+        buf, format="GIF", save_all=True, append_images=images[1:],
+        duration=int(round(1000 / fps)), loop=0, optimize=False
+    )
+    return base64.b64encode(buf.getbuffer()).decode("utf-8")
+
+
+def encode_webp_base64(frames: np.ndarray, fps: float, quality: int = 80) -> str:
+    """Encode (N, H, W) GIF_PALETTE index frames as a looping base64 animated WebP string."""
+    images = [Image.fromarray(frame) for frame in GIF_PALETTE[frames]]
+
+    buf = io.BytesIO()
+    images[0].save(
+        buf, format="WEBP", save_all=True, append_images=images[1:],
+        duration=int(round(1000 / fps)), loop=0, quality=quality, method=4
+    )
+    return base64.b64encode(buf.getbuffer()).decode("utf-8")
+
+
+def encode_png_base64(image_rgb: np.ndarray) -> str:
+    """Encode an RGB uint8 array as a base64 PNG string."""
+    image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+    ok, buffer = cv2.imencode(".png", image_bgr, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        raise ValueError("Failed to encode image as PNG")
+    return base64.b64encode(buffer).decode("utf-8")
+
+
+def encode_jpeg_base64(image: np.ndarray) -> str:
+    """Encode a uint8 image (channels in OpenCV order, like cv2.imencode) as a base64 JPEG string."""
+    image = np.ascontiguousarray(image)
+    if _turbo_jpeg is not None:
+        buffer = _turbo_jpeg.encode(image, quality=JPEG_QUALITY, pixel_format=TJPF_BGR)
+    else:
+        # Skip the Huffman-table optimization pass, the slowest part of the encode
+        ok, buffer = cv2.imencode(
+            ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 0]
+        )
+        if not ok:
+            raise ValueError("Failed to encode image as JPEG")
+    return base64.b64encode(buffer).decode("utf-8")
@@ -62,12 +62,20 @@ def resize_predicted_seg(pred_seg):
     :param pred_seg: predicted segmentation
     :return: resized predicted segmentation
     """
-    resized_img = np.zeros((155, 240, 240, 4))
-    for i in range(155):
-        for j in range(4):
-            resized_img[i, :, :, j] = cv2.resize(pred_seg[i, :, :, j], (240, 240), interpolation=cv2.INTER_NEAREST)
-    pred_seg = resized_img
-    return pred_seg
+    num_slices, height, width, num_classes = pred_seg.shape
+    # Stack every (slice, class) plane as a channel so cv2.resize handles up to 512 planes per call
+    planes = np.ascontiguousarray(
+        pred_seg.transpose(1, 2, 0, 3).reshape(height, width, num_slices * num_classes), dtype=np.float32
+    )
+    resized_planes = np.empty((240, 240, planes.shape[2]), dtype=np.float32)
+    for start in range(0, planes.shape[2], 512):
+        stop = min(start + 512, planes.shape[2])
+        resized_planes[:, :, start:stop] = cv2.resize(
+            planes[:, :, start:stop], (240, 240), interpolation=cv2.INTER_NEAREST
+        ).reshape(240, 240, stop - start)
+
+    resized_img = resized_planes.reshape(240, 240, num_slices, num_classes).transpose(2, 0, 1, 3)
+    return np.ascontiguousarray(resized_img)
 
 
 def predicted_seg_processing(pred_seg, visualization_plane, selected_slice, displayed_class, post_processing_token):
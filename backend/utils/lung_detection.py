@@ -7,9 +7,18 @@ Uses transformers library with PyTorch backend.
 import os
 import numpy as np
 import cv2
-from PIL import Image
+from utils.image_processing_helpers import encode_jpeg_base64
+from utils.lung_detection_ort import load_quantized_model
+from utils.lung_detection_trt import load_trt_engine
+from utils.vit_helpers import (
+    MicroBatcher, build_label_tables, fallback_heatmap, get_inference_dtype, inference_autocast,
+    register_cls_attention_hook
+)
+import itertools
 import torch
-from transformers import ViTImageProcessor, ViTForImageClassification
+import torch.nn.functional as F
+from safetensors.torch import load_file as load_safetensors
+from transformers import ViTConfig, ViTImageProcessor, ViTForImageClassification
 
 # 2 classes for pneumonia detection (from model config)
 CLASS_NAMES = [
@@ -29,16 +38,62 @@ MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "model", "pneumonia")
 MODEL_SAFETENSORS = os.path.join(MODEL_PATH, "model.safetensors")
 # Image size from config.json: 224x224
 IMG_SIZE = 224  # Model expects 224x224 images (from config.json)
+# Rescale (1/255) and normalize (mean 0.5, std 0.5) folded into x * PIXEL_SCALE - 1
+PIXEL_SCALE = np.float32(1 / 127.5)
+
+# Decode directly to RGB where OpenCV supports it, otherwise decode BGR and convert
+IMREAD_FLAG = getattr(cv2, "IMREAD_COLOR_RGB", cv2.IMREAD_COLOR)
+
+# Concurrent requests are classified together: up to 8 images collected within 5 ms
+MAX_BATCH_SIZE = 8
+BATCH_WINDOW = 0.005
 
 # Global model variables
 lung_model = None
+lung_ort_model = None
+_ort_model_checked = False
+lung_trt_engine = None
+lung_compiled_model = None
 processor = None
 device = None
+# Output index -> class name / result type, filled by load_lung_model
+ID2LABEL = []
+ID2RESULT = []
+
+
+def load_model_from_safetensors(model_dtype):
+    """
+    Build the ViT skeleton on the meta device and assign its weights straight from the memory-mapped
+    safetensors file, so weights are paged in on demand instead of being copied twice.
+    The parameters keep pointing at the mapped (and, when preloaded, fork-shared) file pages only while
+    model_dtype matches the float32 checkpoint, i.e. on CPU; a half precision model_dtype casts every
+    tensor into a private copy, which on CUDA is then moved to the device anyway.
+    Falls back to from_pretrained when the checkpoint does not match the skeleton.
+    """
+    try:
+        config = ViTConfig.from_pretrained(MODEL_PATH)
+        with torch.device("meta"):
+            model = ViTForImageClassification(config)
+        state_dict = load_safetensors(MODEL_SAFETENSORS)
+        model.load_state_dict(state_dict, strict=True, assign=True)
+        if any(t.is_meta for t in itertools.chain(model.parameters(), model.buffers())):
+            raise ValueError("Checkpoint does not cover every model tensor")
+        # A no-op for float32; otherwise the cast copies the weights out of the mapped pages
+        return model.to(dtype=model_dtype)
+    except (OSError, MemoryError):
+        raise
+    except Exception as e:
+        print(f"Warning: Memory-mapped safetensors load failed, using from_pretrained: {e}")
+        return ViTForImageClassification.from_pretrained(
+            MODEL_PATH,
+            low_cpu_mem_usage=True,
+            torch_dtype=model_dtype
+        )
 
 
 def load_lung_model():
     """Load the Vision Transformer model and processor from local file."""
-    global lung_model, processor, device
+    global lung_model, lung_trt_engine, lung_compiled_model, processor, device, ID2LABEL, ID2RESULT
     
     if lung_model is None:
         try:
@@ -65,13 +120,14 @@ def load_lung_model():
             # Load processor first (lightweight)
             processor = ViTImageProcessor.from_pretrained(MODEL_PATH)
             
+            # Half precision on tensor-core GPUs; CPU keeps float32 weights with bf16-capable matmuls
+            model_dtype = get_inference_dtype()
+            if not torch.cuda.is_available():
+                torch.set_float32_matmul_precision("medium")
+            
             # Load model with low memory usage option
             try:
-                lung_model = ViTForImageClassification.from_pretrained(
-                    MODEL_PATH,
-                    low_cpu_mem_usage=True,
-                    torch_dtype=torch.float32
-                )
+                lung_model = load_model_from_safetensors(model_dtype)
             except (OSError, MemoryError) as mem_error:
                 # If memory error, try with even more aggressive settings
                 print(f"Initial load failed with memory error, trying with optimized settings: {mem_error}")
@@ -118,7 +174,22 @@ def load_lung_model():
                 else:
                     raise
             
+            # Channels-last lets cuDNN pick its NHWC kernels for the patch-embedding convolution
+            if device.type == "cuda":
+                lung_model = lung_model.to(memory_format=torch.channels_last)
+            
             lung_model.eval()
+            ID2LABEL, ID2RESULT = build_label_tables(lung_model.config, CLASS_NAMES, CLASS_TO_RESULT)
+            register_cls_attention_hook(lung_model)
+            
+            # On CPU, classify with the INT8 ONNX Runtime copy (created on first use, see get_ort_model);
+            # on CUDA, with a TensorRT engine or a CUDA-graph compiled copy (None keeps eager PyTorch).
+            # The eager PyTorch model is still used for the attention heatmap
+            if device.type == "cuda":
+                # Prefer a TensorRT engine specialized for the micro-batch shape, then torch.compile
+                lung_trt_engine = load_trt_engine(lung_model, MODEL_SAFETENSORS, MAX_BATCH_SIZE, IMG_SIZE)
+                if lung_trt_engine is None:
+                    lung_compiled_model = compile_classifier(lung_model)
             
             print(f"Lung detection model loaded successfully on device: {device}")
             if hasattr(lung_model, 'config'):
@@ -132,65 +203,77 @@ def load_lung_model():
     return lung_model, processor, device
 
 
-def preprocess_image(image_file, processor):
+def preprocess_image(image_file):
     """
-    Preprocess image using ViTImageProcessor.
-    The processor will resize to 224x224 and normalize according to preprocessor_config.json.
+    Preprocess image for the ViT model in one OpenCV/NumPy pass.
+    Matches preprocessor_config.json: resize to 224x224, rescale by 1/255 and normalize with
+    mean=[0.5, 0.5, 0.5] and std=[0.5, 0.5, 0.5], i.e. x / 127.5 - 1.
     
     Args:
         image_file: File object or image path
-        processor: ViTImageProcessor instance
     Returns:
-        Processed inputs (tensors) and original PIL image
+        Processed inputs ({"pixel_values": (1, 3, 224, 224) tensor}) and original RGB image array
     """
-    # Read image using PIL
+    # Read image (OpenCV >= 4.10 can decode straight to RGB)
     if isinstance(image_file, str):
         # If it's a file path
-        img = Image.open(image_file).convert('RGB')
+        img = cv2.imread(image_file, IMREAD_FLAG)
+        if img is None:
+            raise ValueError(f"Could not read image from path: {image_file}")
     else:
         # If it's a file object
         image_file.seek(0)  # Reset file pointer
-        img = Image.open(image_file).convert('RGB')
+        img = cv2.imdecode(np.frombuffer(image_file.read(), np.uint8), IMREAD_FLAG)
+        if img is None:
+            raise ValueError("Could not decode image from file object")
+    if IMREAD_FLAG == cv2.IMREAD_COLOR:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     
-    # Process image using ViT processor
-    # The processor will automatically:
-    # - Resize to 224x224 (from preprocessor_config.json)
-    # - Normalize with mean=[0.5, 0.5, 0.5] and std=[0.5, 0.5, 0.5]
-    # - Rescale by 1/255 (0.00392156862745098)
-    inputs = processor(images=img, return_tensors="pt")
+    # INTER_AREA approximates the antialiased PIL bilinear downscale of ViTImageProcessor
+    resized = cv2.resize(img, (IMG_SIZE, IMG_SIZE), interpolation=cv2.INTER_AREA)
+    pixel_values = resized.astype(np.float32) * PIXEL_SCALE - 1.0
+    pixel_values = torch.from_numpy(np.ascontiguousarray(pixel_values.transpose(2, 0, 1))).unsqueeze_(0)
+    # Page-locked memory lets the host-to-device copy run asynchronously
+    if torch.cuda.is_available():
+        pixel_values = pixel_values.pin_memory()
     
     # Return processed inputs and original image
-    return inputs, img
+    return {"pixel_values": pixel_values}, img
 
 
-def generate_heatmap_vit(image, model, inputs, predicted_class_idx):
+def generate_heatmap_vit(img_array, model, inputs, predicted_class_idx):
     """
     Generate attention-based heatmap for ViT model to highlight where the anomaly is.
     Uses the attention weights from the transformer to create a precise heatmap.
+    img_array is the original RGB image array; only its size is used.
     """
+    # Get original image size
+    original_height, original_width = img_array.shape[:2]
     try:
-        # Get original image size
-        img_array = np.array(image)
-        original_height, original_width = img_array.shape[:2]
         
         # Enable gradient computation for attention
         model.eval()
         
         # Get attention weights from the model
-        # We need to access the attention layers
-        with torch.no_grad():
-            outputs = model(**inputs, output_attentions=True)
-            attentions = outputs.attentions  # List of attention tensors from each layer
+        # Only the last layer's [CLS] attention is needed, so the forward hook installed by
+        # load_lung_model stashes it instead of materializing every layer with output_attentions
+        # (the classification forwards leave it off, so they skip the extra projections)
+        last_self_attention = model.vit.encoder.layer[-1].attention.attention
+        last_self_attention.stash_attention = True
+        try:
+            with torch.no_grad():
+                model(**inputs)
+        finally:
+            last_self_attention.stash_attention = False
         
         # Use the last layer's attention (most relevant for classification)
-        # attentions[-1] shape: (batch, num_heads, num_patches+1, num_patches+1)
-        # We want attention to the [CLS] token (index 0) which aggregates information
-        last_layer_attention = attentions[-1]  # Last transformer layer
+        # cls_attention shape: (batch, num_heads, num_patches+1)
+        # It is the [CLS] token's (index 0) attention, which aggregates information
+        cls_attention = last_self_attention.cls_attention
+        last_self_attention.cls_attention = None
         
-        # Average across all attention heads
-        # Shape: (batch, num_heads, num_patches+1, num_patches+1)
-        # We take attention from all tokens to [CLS] token (column 0), excluding [CLS] itself
-        attention_to_cls = last_layer_attention[0, :, 0, 1:].mean(dim=0)  # Average over heads, exclude [CLS] token
+        # Average across all attention heads, excluding [CLS] itself
+        attention_to_cls = cls_attention[0, :, 1:].mean(dim=0)
         
         # Get patch size and number of patches from model config
         patch_size = model.config.patch_size
@@ -202,14 +285,15 @@ def generate_heatmap_vit(image, model, inputs, predicted_class_idx):
         attention_map = attention_to_cls.reshape(num_patches_per_side, num_patches_per_side)
         
         # Normalize attention map
-        attention_map = attention_map.cpu().numpy()
+        attention_map = attention_map.float()
         attention_map = (attention_map - attention_map.min()) / (attention_map.max() - attention_map.min() + 1e-8)
         
-        # Resize attention map to original image size
-        heatmap = cv2.resize(attention_map, (original_width, original_height), interpolation=cv2.INTER_CUBIC)
+        # Resize attention map to original image size on the model's device, then copy to the host once
+        heatmap = F.interpolate(
+            attention_map[None, None], size=(original_height, original_width), mode="bicubic", align_corners=False
+        )[0, 0].cpu().numpy()
         
-        # Apply Gaussian blur for smoother visualization
-        heatmap = cv2.GaussianBlur(heatmap, (21, 21), 0)
+        # No extra blur: the bicubic upscale of the 14x14 patch grid is already smooth at this size
         
         # Normalize again after resize
         if heatmap.max() > 0:
@@ -226,17 +310,64 @@ def generate_heatmap_vit(image, model, inputs, predicted_class_idx):
         print(f"Error generating attention heatmap: {str(e)}")
         import traceback
         traceback.print_exc()
-        # Fallback: create a simple centered heatmap
-        img_array = np.array(image)
-        original_height, original_width = img_array.shape[:2]
-        heatmap = np.zeros((original_height, original_width), dtype=np.float32)
-        center_y, center_x = original_height // 2, original_width // 2
-        y, x = np.ogrid[:original_height, :original_width]
-        mask = (x - center_x)**2 + (y - center_y)**2 <= min(original_height, original_width)**2 // 4
-        heatmap[mask] = 0.7
-        heatmap_colored = cv2.applyColorMap((heatmap * 255).astype(np.uint8), cv2.COLORMAP_JET)
-        heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
-        return heatmap_colored, heatmap
+        # Fallback: a simple centered heatmap
+        return fallback_heatmap(original_height, original_width)
+
+
+def compile_classifier(model):
+    """
+    torch.compile the classifier with CUDA graphs for the fixed (MAX_BATCH_SIZE, 3, 224, 224) input.
+    Returns None (eager PyTorch is used) when compilation is unavailable or fails.
+    """
+    try:
+        compiled_model = torch.compile(model, mode="reduce-overhead")
+        dummy = torch.zeros(MAX_BATCH_SIZE, 3, IMG_SIZE, IMG_SIZE, device=device, dtype=model.dtype)
+        dummy = dummy.to(memory_format=torch.channels_last)
+        # The first call compiles, the second records the CUDA graph that later calls replay
+        with torch.no_grad(), inference_autocast(model):
+            for _ in range(2):
+                compiled_model(pixel_values=dummy)
+        return compiled_model
+    except Exception as e:
+        print(f"Warning: torch.compile unavailable for the lung model, using eager PyTorch: {e}")
+        return None
+
+
+def get_ort_model():
+    """
+    INT8 ONNX Runtime classifier on CPU (None keeps PyTorch).
+    Created on first use rather than in load_lung_model: ONNX Runtime starts its thread pool with the
+    session, and those threads would not survive the fork when the model is preloaded in the master.
+    """
+    global lung_ort_model, _ort_model_checked
+    if device.type == "cpu" and not _ort_model_checked:
+        lung_ort_model = load_quantized_model(MODEL_PATH)
+        _ort_model_checked = True
+    return lung_ort_model
+
+
+def classify_batch(pixel_values):
+    """Run one classification forward over a (N, 3, 224, 224) batch and return its logits."""
+    ort_model = get_ort_model()
+    if ort_model is not None:
+        return ort_model(pixel_values=pixel_values).logits
+    if lung_trt_engine is not None:
+        return lung_trt_engine(pixel_values)
+    if lung_compiled_model is not None:
+        # Pad to the captured batch size so every call replays the same CUDA graph, and clone the
+        # logits out of the graph's static output buffer before the next replay overwrites them
+        num_images = pixel_values.shape[0]
+        padded = pixel_values.new_zeros((MAX_BATCH_SIZE,) + pixel_values.shape[1:])
+        padded = padded.to(memory_format=torch.channels_last)
+        padded[:num_images] = pixel_values
+        with torch.no_grad(), inference_autocast(lung_model):
+            return lung_compiled_model(pixel_values=padded).logits[:num_images].clone()
+    with torch.no_grad(), inference_autocast(lung_model):
+        return lung_model(pixel_values=pixel_values).logits
+
+
+# Queues one preprocessed image for batched classification and waits for its (1, num_classes) logits
+classify_pixel_values = MicroBatcher(classify_batch, MAX_BATCH_SIZE, BATCH_WINDOW)
 
 
 def predict_lung_condition(image_file):
@@ -250,33 +381,26 @@ def predict_lung_condition(image_file):
     model, processor, device = load_lung_model()
     
     # Preprocess image
-    inputs, img_original = preprocess_image(image_file, processor)
+    inputs, img_original = preprocess_image(image_file)
     
-    # Move inputs to device
-    inputs = {k: v.to(device) for k, v in inputs.items()}
+    # Move inputs to device, matching the model's (possibly half precision) dtype and memory format
+    inputs = {k: v.to(device, dtype=model.dtype, non_blocking=True) for k, v in inputs.items()}
+    if device.type == "cuda":
+        inputs["pixel_values"] = inputs["pixel_values"].to(memory_format=torch.channels_last)
     
-    # Make prediction
-    with torch.no_grad():
-        outputs = model(**inputs)
+    # Make prediction (coalesced with concurrent requests into one forward pass)
+    logits = classify_pixel_values(inputs["pixel_values"])
     
-    # Get prediction results
-    logits = outputs.logits
+    # Get prediction results (softmax in float32 for numerical safety)
+    logits = logits.float()
     probabilities = torch.nn.functional.softmax(logits, dim=1)[0]
     
     # Get predicted class index and confidence
     predicted_class_idx = torch.argmax(probabilities).item()
     confidence = probabilities[predicted_class_idx].item()
     
-    # Get predicted class name from model config or use our mapping
-    if hasattr(model.config, 'id2label') and model.config.id2label:
-        predicted_class = model.config.id2label[predicted_class_idx]
-    else:
-        # Fallback to our class names if model doesn't have id2label
-        if predicted_class_idx < len(CLASS_NAMES):
-            predicted_class = CLASS_NAMES[predicted_class_idx]
-        else:
-            predicted_class = f"Class_{predicted_class_idx}"
-            print(f"Warning: Predicted class index {predicted_class_idx} out of range")
+    # Get predicted class name from the label table built at load time
+    predicted_class = ID2LABEL[predicted_class_idx]
     
     # Convert probabilities to numpy for easier manipulation
     probabilities_np = probabilities.cpu().numpy()
@@ -285,44 +409,30 @@ def predict_lung_condition(image_file):
     top_indices = np.argsort(probabilities_np)[::-1][:min(2, len(probabilities_np))]
     
     # Get result type (Malign/Benign/Normal)
-    result_type = CLASS_TO_RESULT.get(predicted_class, "Normal")
+    result_type = ID2RESULT[predicted_class_idx]
     
     # Generate heatmap
-    img_array = np.array(img_original)
-    heatmap_colored, heatmap_raw = generate_heatmap_vit(img_original, model, inputs, predicted_class_idx)
-    
-    # Overlay heatmap on original image
-    img_original_float = img_array.astype(np.float32) / 255.0
-    heatmap_resized = cv2.resize(heatmap_colored, (img_array.shape[1], img_array.shape[0]))
-    heatmap_float = heatmap_resized.astype(np.float32) / 255.0
+    img_array = np.asarray(img_original)
+    heatmap_colored, heatmap_raw = generate_heatmap_vit(img_array, model, inputs, predicted_class_idx)
     
-    # Blend images (70% original, 30% heatmap)
-    overlay = cv2.addWeighted(img_original_float, 0.7, heatmap_float, 0.3, 0)
-    overlay_uint8 = (overlay * 255).astype(np.uint8)
+    # Overlay heatmap on original image (both already at the original size)
+    # Blend images (70% original, 30% heatmap) directly in uint8
+    overlay_uint8 = cv2.addWeighted(img_array, 0.7, heatmap_colored, 0.3, 0)
     
     # Calculate metrics
     model_precision = float(confidence * 100)  # Top prediction confidence
+    probabilities_pct = (probabilities_np * 100).tolist()
     top3_predictions = [
         {
-            "class": model.config.id2label[idx] if hasattr(model.config, 'id2label') and idx in model.config.id2label 
-                     else (CLASS_NAMES[idx] if idx < len(CLASS_NAMES) else f"Class_{idx}"),
-            "confidence": float(probabilities_np[idx] * 100),
-            "result_type": CLASS_TO_RESULT.get(
-                model.config.id2label[idx] if hasattr(model.config, 'id2label') and idx in model.config.id2label 
-                else (CLASS_NAMES[idx] if idx < len(CLASS_NAMES) else "Normal"), 
-                "Normal"
-            )
+            "class": ID2LABEL[idx],
+            "confidence": probabilities_pct[idx],
+            "result_type": ID2RESULT[idx]
         }
         for idx in top_indices
     ]
     
     # Get all predictions
-    all_predictions = {}
-    for i in range(len(probabilities_np)):
-        class_name = model.config.id2label[i] if hasattr(model.config, 'id2label') and i in model.config.id2label else (
-            CLASS_NAMES[i] if i < len(CLASS_NAMES) else f"Class_{i}"
-        )
-        all_predictions[class_name] = float(probabilities_np[i] * 100)
+    all_predictions = dict(zip(ID2LABEL, probabilities_pct))
     
     # Calculate explanation and recommendations
     explanation, recommendations = get_explanation_and_recommendations(
@@ -336,8 +446,8 @@ def predict_lung_condition(image_file):
         "model_precision": model_precision,
         "top3_predictions": top3_predictions,
         "all_predictions": all_predictions,
-        "heatmap": overlay_uint8,
-        "heatmap_raw": heatmap_colored,
+        "heatmap": encode_jpeg_base64(overlay_uint8),
+        "heatmap_raw": encode_jpeg_base64(heatmap_colored),
         "explanation": explanation,
         "recommendations": recommendations
     }
@@ -0,0 +1,49 @@
+"""
+Dynamic INT8 ONNX Runtime copy of the pneumonia ViT for CPU inference.
+The model is exported and quantized once into MODEL_PATH/int8; importers fall back to PyTorch when
+Optimum / ONNX Runtime are unavailable.
+"""
+
+import os
+
+# Optimum's ONNX Runtime integration is optional; without it the PyTorch model is used
+try:
+    from optimum.onnxruntime import ORTModelForImageClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    ORT_AVAILABLE = True
+except Exception:
+    ORT_AVAILABLE = False
+
+QUANTIZED_FILE_NAME = "model_quantized.onnx"
+
+
+def load_quantized_model(model_path: str):
+    """
+    Return the INT8 ORTModelForImageClassification for model_path, or None when it cannot be used.
+    The quantized artifact is cached under model_path/int8 and rebuilt when the weights are newer.
+    """
+    if not ORT_AVAILABLE:
+        return None
+
+    int8_dir = os.path.join(model_path, "int8")
+    quantized_file = os.path.join(int8_dir, QUANTIZED_FILE_NAME)
+    weights_file = os.path.join(model_path, "model.safetensors")
+
+    try:
+        is_fresh = (
+            os.path.exists(quantized_file)
+            and os.path.getmtime(quantized_file) >= os.path.getmtime(weights_file)
+        )
+        if not is_fresh:
+            print("Exporting and INT8-quantizing the lung detection model with ONNX Runtime...")
+            onnx_model = ORTModelForImageClassification.from_pretrained(model_path, export=True)
+            quantizer = ORTQuantizer.from_pretrained(onnx_model)
+            # Dynamic (weight-only calibration-free) quantization; runs on any AVX2/AVX-512 CPU
+            quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=int8_dir, quantization_config=quantization_config)
+            print(f"Quantized lung detection model saved to: {int8_dir}")
+
+        return ORTModelForImageClassification.from_pretrained(int8_dir, file_name=QUANTIZED_FILE_NAME)
+    except Exception as e:
+        print(f"Warning: INT8 ONNX Runtime model unavailable, using PyTorch: {e}")
+        return None
@@ -0,0 +1,129 @@
+"""
+TensorRT FP16 engine for the pneumonia ViT.
+Exports the model to ONNX once for the fixed (MAX_BATCH_SIZE, 3, 224, 224) micro-batch shape, builds (and
+caches) a TensorRT engine specialized for it, and runs it on PyTorch's CUDA stream through persistent
+device buffers. Importers fall back to PyTorch when TensorRT is unavailable.
+"""
+
+import copy
+import os
+import threading
+import torch
+from utils.vit_helpers import LogitsOnly
+
+# TensorRT is optional; without it the PyTorch model is used
+try:
+    import tensorrt as trt
+    TRT_AVAILABLE = True
+except Exception:
+    TRT_AVAILABLE = False
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "model", "pneumonia")
+ONNX_FILE = os.path.join(MODEL_PATH, "model_static.onnx")
+ENGINE_FILE = os.path.join(MODEL_PATH, "model_fp16.plan")
+
+INPUT_NAME = "pixel_values"
+OUTPUT_NAME = "logits"
+ONNX_OPSET = 17
+WORKSPACE_BYTES = 1 << 30
+
+
+class TRTLungEngine:
+    """Persistent TensorRT execution context with static device buffers for one micro-batch shape."""
+
+    def __init__(self, serialized_engine: bytes):
+        self._logger = trt.Logger(trt.Logger.WARNING)
+        self._runtime = trt.Runtime(self._logger)
+        self._engine = self._runtime.deserialize_cuda_engine(serialized_engine)
+        self._context = self._engine.create_execution_context()
+        # An execution context must not be used by two batches at once
+        self._lock = threading.Lock()
+
+        input_shape = tuple(self._engine.get_tensor_shape(INPUT_NAME))
+        output_shape = tuple(self._engine.get_tensor_shape(OUTPUT_NAME))
+        self.batch_size = input_shape[0]
+        self._input = torch.zeros(input_shape, dtype=torch.float32, device="cuda")
+        self._output = torch.empty(output_shape, dtype=torch.float32, device="cuda")
+        self._context.set_tensor_address(INPUT_NAME, self._input.data_ptr())
+        self._context.set_tensor_address(OUTPUT_NAME, self._output.data_ptr())
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Run an (N, 3, 224, 224) CUDA batch (N <= engine batch) and return its (N, num_classes) logits."""
+        num_images = pixel_values.shape[0]
+        with self._lock:
+            # Copies and the engine are queued on the same stream, so they run in order
+            self._input[:num_images].copy_(pixel_values)
+            self._input[num_images:].zero_()
+            if not self._context.execute_async_v3(torch.cuda.current_stream().cuda_stream):
+                raise RuntimeError("TensorRT inference failed")
+            return self._output[:num_images].clone()
+
+
+def export_onnx(model, batch_size: int, image_size: int, onnx_file: str = ONNX_FILE) -> None:
+    """Export a float32 copy of the ViT to ONNX with a fully static input shape."""
+    export_model = LogitsOnly(copy.deepcopy(model).float().eval())
+    dummy = torch.zeros(batch_size, 3, image_size, image_size, device=next(model.parameters()).device)
+    with torch.no_grad():
+        torch.onnx.export(
+            export_model, (dummy,), onnx_file, opset_version=ONNX_OPSET,
+            input_names=[INPUT_NAME], output_names=[OUTPUT_NAME], dynamic_axes=None
+        )
+
+
+def build_engine(onnx_file: str = ONNX_FILE) -> bytes:
+    """Build a serialized TensorRT engine from the ONNX file, using FP16 kernels where supported."""
+    logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, logger)
+
+    with open(onnx_file, "rb") as f:
+        if not parser.parse(f.read()):
+            errors = "\n".join(str(parser.get_error(i)) for i in range(parser.num_errors))
+            raise RuntimeError(f"Failed to parse ONNX model:\n{errors}")
+
+    config = builder.create_builder_config()
+    config.set_memory_pool_limit(trt.MemoryPoolType.WORKSPACE, WORKSPACE_BYTES)
+    if builder.platform_has_fast_fp16:
+        config.set_flag(trt.BuilderFlag.FP16)
+
+    serialized_engine = builder.build_serialized_network(network, config)
+    if serialized_engine is None:
+        raise RuntimeError("TensorRT engine build failed")
+    return bytes(serialized_engine)
+
+
+def load_trt_engine(model, source_file: str, batch_size: int, image_size: int):
+    """
+    Return a TRTLungEngine for model, or None when TensorRT cannot be used.
+    The engine plan is cached next to the model and rebuilt when source_file is newer.
+    """
+    if not TRT_AVAILABLE:
+        return None
+
+    try:
+        plan_is_fresh = (
+            os.path.exists(ENGINE_FILE)
+            and os.path.getmtime(ENGINE_FILE) >= os.path.getmtime(source_file)
+        )
+        if plan_is_fresh:
+            with open(ENGINE_FILE, "rb") as f:
+                serialized_engine = f.read()
+        else:
+            print("Building TensorRT FP16 engine for the lung detection model...")
+            export_onnx(model, batch_size, image_size)
+            serialized_engine = build_engine()
+            with open(ENGINE_FILE, "wb") as f:
+                f.write(serialized_engine)
+            print(f"TensorRT engine saved to: {ENGINE_FILE}")
+
+        engine = TRTLungEngine(serialized_engine)
+        if engine.batch_size != batch_size:
+            raise ValueError("Cached engine was built for a different batch size")
+        # Run once here, so an engine that cannot execute falls back to PyTorch at load time
+        engine(torch.zeros(batch_size, 3, image_size, image_size, device="cuda"))
+        torch.cuda.synchronize()
+        return engine
+    except Exception as e:
+        print(f"Warning: TensorRT engine unavailable, using PyTorch: {e}")
+        return None
@@ -5,19 +5,25 @@ import numpy as np
 from typing import Dict, Any
 
 
-def calculate_class_metrics(pred_vol: np.ndarray, voxel_volume_mm3: float) -> Dict[int, Dict[str, Any]]:
-    """Calculate metrics for each tumor class."""
+def count_class_voxels(pred_vol: np.ndarray) -> np.ndarray:
+    """Count the voxels of every label (at least classes 0-3) in a single pass over the volume."""
+    return np.bincount(pred_vol.ravel(), minlength=4)
+
+
+def calculate_class_metrics(pred_vol: np.ndarray, voxel_volume_mm3: float, counts: np.ndarray | None = None) -> Dict[int, Dict[str, Any]]:
+    """Calculate metrics for each tumor class (counts: precomputed count_class_voxels(pred_vol))."""
+    if counts is None:
+        counts = count_class_voxels(pred_vol)
     total_voxels = pred_vol.size
     class_metrics = {}
     
     for class_id in [1, 2, 3]:
-        class_mask = (pred_vol == class_id)
-        class_voxels = np.sum(class_mask)
+        class_voxels = int(counts[class_id])
         class_volume_mm3 = class_voxels * voxel_volume_mm3
         class_percentage = (class_voxels / total_voxels * 100) if total_voxels > 0 else 0
         
         class_metrics[class_id] = {
-            "voxel_count": int(class_voxels),
+            "voxel_count": class_voxels,
             "volume_mm3": round(class_volume_mm3, 2),
             "volume_cm3": round(class_volume_mm3 / 1000, 2),
             "percentage": round(class_percentage, 2)
@@ -26,16 +32,17 @@ def calculate_class_metrics(pred_vol: np.ndarray, voxel_volume_mm3: float) -> Di
     return class_metrics
 
 
-def calculate_total_tumor_metrics(pred_vol: np.ndarray, voxel_volume_mm3: float) -> Dict[str, Any]:
+def calculate_total_tumor_metrics(pred_vol: np.ndarray, voxel_volume_mm3: float, counts: np.ndarray | None = None) -> Dict[str, Any]:
     """Calculate total tumor volume metrics (all classes combined)."""
+    if counts is None:
+        counts = count_class_voxels(pred_vol)
     total_voxels = pred_vol.size
-    tumor_mask = (pred_vol > 0)
-    total_tumor_voxels = np.sum(tumor_mask)
+    total_tumor_voxels = int(counts[1:].sum())
     total_tumor_volume_mm3 = total_tumor_voxels * voxel_volume_mm3
     total_tumor_percentage = (total_tumor_voxels / total_voxels * 100) if total_voxels > 0 else 0
     
     return {
-        "voxel_count": int(total_tumor_voxels),
+        "voxel_count": total_tumor_voxels,
         "volume_mm3": round(total_tumor_volume_mm3, 2),
         "volume_cm3": round(total_tumor_volume_mm3 / 1000, 2),
         "percentage": round(total_tumor_percentage, 2)
@@ -0,0 +1,136 @@
+"""
+Numba-compiled kernels for the hot array loops of the segmentation pipeline.
+Each public function falls back to an equivalent NumPy implementation when Numba is not installed.
+"""
+import cv2
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _resize_normalize_kernel(flair, t1ce, num_slices, size):
+        height, width = flair.shape[0], flair.shape[1]
+        out = np.empty((num_slices, size, size, 2), dtype=np.float32)
+        slice_max = np.empty(num_slices, dtype=np.float32)
+        scale_y = height / size
+        scale_x = width / size
+        for d in prange(num_slices):
+            local_max = -np.inf
+            for i in range(size):
+                # Same source mapping and border clamping as cv2.resize INTER_LINEAR
+                sy = (i + 0.5) * scale_y - 0.5
+                y0 = int(np.floor(sy))
+                fy = sy - y0
+                if y0 < 0:
+                    y0, fy = 0, 0.0
+                if y0 >= height - 1:
+                    y0, fy = height - 1, 0.0
+                y1 = min(y0 + 1, height - 1)
+                for j in range(size):
+                    sx = (j + 0.5) * scale_x - 0.5
+                    x0 = int(np.floor(sx))
+                    fx = sx - x0
+                    if x0 < 0:
+                        x0, fx = 0, 0.0
+                    if x0 >= width - 1:
+                        x0, fx = width - 1, 0.0
+                    x1 = min(x0 + 1, width - 1)
+                    for c in range(2):
+                        vol = flair if c == 0 else t1ce
+                        top = vol[y0, x0, d] * (1 - fx) + vol[y0, x1, d] * fx
+                        bottom = vol[y1, x0, d] * (1 - fx) + vol[y1, x1, d] * fx
+                        v = np.float32(top * (1 - fy) + bottom * fy)
+                        out[d, i, j, c] = v
+                        if v > local_max:
+                            local_max = v
+            slice_max[d] = local_max
+
+        inv_max = np.float32(1) / slice_max.max()
+        for d in prange(num_slices):
+            for i in range(size):
+                for j in range(size):
+                    out[d, i, j, 0] *= inv_max
+                    out[d, i, j, 1] *= inv_max
+        return out
+
+    # No fastmath here: it lets LLVM assume values are never NaN, which would drop the v != v checks.
+    # nogil lets the slice kernels run concurrently from the GIF render threads
+    @njit(cache=True, nogil=True)
+    def _normalize_slice_kernel(slc):
+        height, width = slc.shape
+        lo, hi = np.inf, -np.inf
+        for i in range(height):
+            for j in range(width):
+                v = slc[i, j]
+                if v != v:
+                    v = 0.0
+                if v < lo:
+                    lo = v
+                if v > hi:
+                    hi = v
+
+        out = np.empty((height, width), dtype=np.uint8)
+        scale = np.float32(255) / np.float32(hi - lo + 1e-8)
+        for i in range(height):
+            for j in range(width):
+                v = slc[i, j]
+                if v != v:
+                    v = 0.0
+                out[i, j] = np.uint8((v - lo) * scale)
+        return out
+
+    @njit(cache=True, nogil=True)
+    def _filter_class_kernel(pred_slice, class_value):
+        height, width = pred_slice.shape
+        out = np.empty((height, width), dtype=pred_slice.dtype)
+        for i in range(height):
+            for j in range(width):
+                out[i, j] = pred_slice[i, j] if pred_slice[i, j] == class_value else 0
+        return out
+
+
+def resize_normalize_volume(flair: np.ndarray, t1ce: np.ndarray, num_slices: int, size: int) -> np.ndarray:
+    """
+    Bilinearly resize the first num_slices depth slices of two (H, W, D) float32 volumes to size x size
+    and divide by the global maximum, returning the (num_slices, size, size, 2) FLAIR/T1CE model input.
+    The Numba kernel resizes slices in parallel and fuses the normalization into the same pass.
+    """
+    # The kernel indexes without bounds checks, so short or mismatched volumes must be rejected here
+    if t1ce.shape != flair.shape:
+        raise ValueError(f"FLAIR and T1CE volumes differ in shape: {flair.shape} vs {t1ce.shape}")
+    if flair.ndim != 3 or flair.shape[2] < num_slices:
+        raise ValueError(f"Expected an (H, W, D) volume with at least {num_slices} slices, got {flair.shape}")
+    if NUMBA_AVAILABLE:
+        return _resize_normalize_kernel(flair, t1ce, num_slices, size)
+    # Every (slice, modality) plane is a channel of a single cv2.resize call
+    height, width = flair.shape[:2]
+    planes = np.stack([flair[:, :, :num_slices], t1ce[:, :, :num_slices]], axis=-1)
+    planes = cv2.resize(planes.reshape(height, width, num_slices * 2), (size, size))
+    X = np.ascontiguousarray(planes.reshape(size, size, num_slices, 2).transpose(2, 0, 1, 3))
+    np.divide(X, X.max(), out=X)
+    return X
+
+
+def normalize_slice_u8(slc: np.ndarray) -> np.ndarray:
+    """
+    Min-max normalize a 2D slice to uint8 with NaNs treated as 0.
+    The Numba kernel streams the slice twice without allocating float temporaries.
+    """
+    if NUMBA_AVAILABLE:
+        return _normalize_slice_kernel(slc)
+    slc = np.nan_to_num(slc.astype(np.float32))
+    lo, hi = slc.min(), slc.max()
+    return ((slc - lo) * (255 / (hi - lo + 1e-8))).astype(np.uint8)
+
+
+def filter_class(pred_slice: np.ndarray, class_value: int) -> np.ndarray:
+    """Keep only class_value in a 2D label slice (zeros elsewhere), in one pass."""
+    if NUMBA_AVAILABLE:
+        return _filter_class_kernel(pred_slice, pred_slice.dtype.type(class_value))
+    return np.where(pred_slice == class_value, pred_slice, 0)
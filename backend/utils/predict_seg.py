@@ -1,13 +1,21 @@
-from utils.variables import data_path, VOLUME_SLICES, IMG_SIZE
+from utils.variables import data_path, VOLUME_SLICES, IMG_SIZE, best_weights_path
 from utils.session import SESSION_STATE    # <-- new import
+from utils.numba_kernels import resize_normalize_volume
 import nibabel as nib
 import numpy as np
-import cv2
+import functools
+import hashlib
 import random
 import os
 
 from utils.UNet_2D import *
 
+# Slices per forward pass (SEG_PREDICT_BATCH_SIZE overrides it to fit the GPU; 155 runs a volume at once)
+PREDICT_BATCH_SIZE = int(os.environ.get("SEG_PREDICT_BATCH_SIZE", 32))
+
+# Predicted label volumes survive restarts here (a few hundred KB each, compressed)
+LABEL_CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", "cache", "segmentation")
+
 
 def get_selected_patient_path(samples_list, selected_sample):
     """
@@ -42,10 +50,8 @@ def predict_btn_click(model, patient_path):
     return SESSION_STATE.get("pred_seg")
 
 
-def predict_segmentation(model, patient_path):
-    """
-    Predict patient segmentation.
-    """
+def get_input_modality_paths(patient_path):
+    """Return the (t1ce, flair) file paths of a patient, as .nii or .nii.gz."""
     # Try to load files with .nii or .nii.gz extension
     t1ce_path = patient_path + '_t1ce.nii'
     flair_path = patient_path + '_flair.nii'
@@ -55,23 +61,112 @@ def predict_segmentation(model, patient_path):
         t1ce_path = t1ce_path + '.gz'
     if not os.path.exists(flair_path):
         flair_path = flair_path + '.gz'
+    return t1ce_path, flair_path
+
+
+def get_label_cache_file(patient_path, predictor_tag):
+    """
+    Disk cache file of a patient's predicted labels.
+    The name hashes the patient path with the input and model file mtimes and the predictor's
+    backend / precision tag (see get_predictor_tag), so edits or a switch such as SEG_INT8=0 invalidate it.
+    """
+    t1ce_path, flair_path = get_input_modality_paths(patient_path)
+    model_source = get_model_source()
+    weights_mtime = os.path.getmtime(best_weights_path) if os.path.exists(best_weights_path) else 0
+    source_mtime = os.path.getmtime(model_source) if os.path.exists(model_source) else 0
+    key_source = (
+        f"{patient_path}:{os.path.getmtime(t1ce_path)}:{os.path.getmtime(flair_path)}"
+        f":{weights_mtime}:{model_source}:{source_mtime}:{predictor_tag}"
+    )
+    key = hashlib.blake2b(key_source.encode(), digest_size=16).hexdigest()
+    return os.path.join(LABEL_CACHE_DIR, f"{key}.npz")
+
+
+@functools.lru_cache(maxsize=8)
+def load_cached_labels(cache_file):
+    """Read a cached (VOLUME_SLICES, IMG_SIZE, IMG_SIZE) label volume; it is shared, so read-only."""
+    with np.load(cache_file) as data:
+        labels = data["labels"]
+    labels.setflags(write=False)
+    return labels
+
+
+def save_cached_labels(cache_file, labels):
+    """Write a label volume to the disk cache atomically, so readers never see a partial file."""
+    os.makedirs(LABEL_CACHE_DIR, exist_ok=True)
+    tmp_file = f"{cache_file[:-len('.npz')]}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_file, labels=labels)
+    os.replace(tmp_file, cache_file)
+
+
+def preprocess_volume(patient_path, slice_indices=None):
+    """
+    Build the (slices, IMG_SIZE, IMG_SIZE, 2) FLAIR/T1CE model input of a patient.
+    Only the depth slices in slice_indices (all VOLUME_SLICES by default) are returned, in that order.
+    """
+    t1ce_path, flair_path = get_input_modality_paths(patient_path)
     
-    # Load modalities
-    t1ce = nib.load(t1ce_path).get_fdata()
-    flair = nib.load(flair_path).get_fdata()
+    # Load modalities (only the depth slices the model consumes, as float32 straight from the data proxy)
+    t1ce = np.asarray(nib.load(t1ce_path).dataobj[:, :, :VOLUME_SLICES], dtype=np.float32)
+    flair = np.asarray(nib.load(flair_path).dataobj[:, :, :VOLUME_SLICES], dtype=np.float32)
+
+    # Resize slices and normalize by the volume maximum (Numba-parallel when available)
+    X = resize_normalize_volume(flair, t1ce, VOLUME_SLICES, IMG_SIZE)
 
-    # Preprocess slices
-    X = np.empty((VOLUME_SLICES, IMG_SIZE, IMG_SIZE, 2), dtype=np.float32)
+    # The normalization uses the whole volume, so a slice predicts the same either way
+    if slice_indices is not None:
+        X = X[list(slice_indices)]
+    # Half precision input halves the host-to-device copy under mixed precision
+    if USE_MIXED_PRECISION:
+        X = X.astype(np.float16)
+    return np.ascontiguousarray(X)
 
-    for j in range(VOLUME_SLICES):
-        X[j, :, :, 0] = cv2.resize(flair[:, :, j], (IMG_SIZE, IMG_SIZE))
-        X[j, :, :, 1] = cv2.resize(t1ce[:, :, j], (IMG_SIZE, IMG_SIZE))
 
-    # Normalize
-    X = X / np.max(X)
+def predict_segmentation(model, patient_path, slice_indices=None):
+    """
+    Predict patient segmentation.
+    Only the depth slices in slice_indices (all VOLUME_SLICES by default) are run through the model,
+    in that order.
+    """
+    X = preprocess_volume(patient_path, slice_indices)
 
     # Predict
-    return model.predict(X, verbose=0)
+    with tf.device(INFERENCE_DEVICE):
+        return model.predict(X, batch_size=PREDICT_BATCH_SIZE, verbose=0)
+
+
+def predict_segmentation_labels(model, patient_path, slice_indices=None):
+    """
+    Predict patient segmentation as (slices, IMG_SIZE, IMG_SIZE) uint8 class labels.
+    The argmax runs on the inference device, so the class probabilities never cross to the host.
+    Full-volume predictions are cached on disk, and slice requests are served from that cache too.
+    """
+    cache_file = get_label_cache_file(patient_path, get_predictor_tag(model))
+    if os.path.exists(cache_file):
+        labels = load_cached_labels(cache_file)
+        return labels if slice_indices is None else labels[list(slice_indices)]
+
+    X = preprocess_volume(patient_path, slice_indices)
+    predict_labels = label_predictor(model)
+
+    # Pad to whole batches so the compiled function only ever sees one input shape
+    num_slices = X.shape[0]
+    padded_slices = -(-num_slices // PREDICT_BATCH_SIZE) * PREDICT_BATCH_SIZE
+    if padded_slices != num_slices:
+        padding = np.zeros((padded_slices - num_slices,) + X.shape[1:], dtype=X.dtype)
+        X = np.concatenate([X, padding])
+
+    # Dispatch every batch before reading any back, so the device never waits on a host copy
+    with tf.device(INFERENCE_DEVICE):
+        batch_labels = [
+            predict_labels(X[start:start + PREDICT_BATCH_SIZE])
+            for start in range(0, padded_slices, PREDICT_BATCH_SIZE)
+        ]
+    labels = np.concatenate([np.asarray(batch) for batch in batch_labels])[:num_slices]
+
+    if slice_indices is None:
+        save_cached_labels(cache_file, labels)
+    return labels
 
 
 def patient_has_changed_update_token():
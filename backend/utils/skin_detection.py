@@ -5,10 +5,18 @@ Uses transformers library with PyTorch backend.
 """
 
 import os
+import threading
 import numpy as np
 import cv2
-from PIL import Image
+from utils.image_processing_helpers import encode_jpeg_base64
+from utils.skin_detection_ort import load_ort_classifier
+from utils.vit_helpers import (
+    MicroBatcher, build_label_tables, fallback_heatmap, get_inference_dtype, inference_autocast,
+    register_cls_attention_hook
+)
+from gevent.threadpool import ThreadPoolExecutor
 import torch
+import torch.nn.functional as F
 from transformers import ViTImageProcessor, ViTForImageClassification
 
 # 12 classes of skin conditions (from Hugging Face model)
@@ -54,15 +62,169 @@ MODEL_SAFETENSORS = os.path.join(MODEL_PATH, "model.safetensors")
 # Image size from config.json: 384x384
 IMG_SIZE = 384  # Model expects 384x384 images (from config.json)
 
+# 1D Gaussian taps of the heatmap blur (same kernel as cv2.GaussianBlur with ksize 21, sigma 0)
+BLUR_KERNEL = torch.from_numpy(cv2.getGaussianKernel(21, 0).astype(np.float32).ravel())
+
+# Decode directly to RGB where OpenCV supports it, otherwise decode BGR and convert
+IMREAD_FLAG = getattr(cv2, "IMREAD_COLOR_RGB", cv2.IMREAD_COLOR)
+
+# Concurrent requests are classified together: up to 8 images collected within 5 ms, padded to the
+# nearest batch bucket so the compiled model / CUDA graphs only ever see these shapes
+BATCH_BUCKETS = (1, 2, 4, 8)
+MAX_BATCH_SIZE = BATCH_BUCKETS[-1]
+BATCH_WINDOW = 0.005
+
+# Native threads that decode and resize uploads off the gevent hub
+PREPROCESS_WORKERS = 4
+_preprocess_executor = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS)
+
 # Global model variables
 skin_model = None
+skin_ort_model = None
+skin_compiled_model = None
+skin_graph_runner = None
 processor = None
 device = None
+# Layout of the model input: channels-last on CUDA (see load_skin_model), contiguous NCHW otherwise
+memory_format = torch.contiguous_format
+# Output index -> class name / result type, filled by load_skin_model
+ID2LABEL = []
+ID2RESULT = []
+
+
+def get_batch_bucket(num_images):
+    """Smallest compiled/captured batch size that holds num_images."""
+    return next(bucket for bucket in BATCH_BUCKETS if bucket >= num_images)
+
+
+def pad_to_bucket(pixel_values):
+    """Zero-pad a (N, 3, 384, 384) batch to its bucket size."""
+    num_images = pixel_values.shape[0]
+    bucket = get_batch_bucket(num_images)
+    if bucket == num_images:
+        return pixel_values
+    padded = pixel_values.new_zeros((bucket,) + pixel_values.shape[1:]).to(memory_format=memory_format)
+    padded[:num_images] = pixel_values
+    return padded
+
+
+def compile_classifier(model):
+    """
+    torch.compile the classifier (max-autotune, specialized to each (bucket, 3, 384, 384) input) and
+    warm every batch bucket up so no request pays for compilation.
+    Returns None (eager PyTorch is used) when compilation is unavailable or fails.
+    """
+    try:
+        compiled_model = torch.compile(model, mode="max-autotune", dynamic=False)
+        with torch.inference_mode(), inference_autocast(model):
+            for bucket in BATCH_BUCKETS:
+                dummy = torch.zeros(bucket, 3, IMG_SIZE, IMG_SIZE, device=model.device, dtype=model.dtype)
+                dummy = dummy.to(memory_format=memory_format)
+                for _ in range(2):
+                    compiled_model(pixel_values=dummy)
+        return compiled_model
+    except Exception as e:
+        print(f"Warning: torch.compile unavailable for the skin model, using eager PyTorch: {e}")
+        return None
+
+
+class CUDAGraphClassifier:
+    """
+    Replays CUDA graphs of the eager classifier forward, one per (bucket, 3, 384, 384) input shape.
+    Used on CUDA when torch.compile is unavailable (e.g. no Triton); inputs are copied into static buffers.
+    """
+
+    def __init__(self, model):
+        # The graphs' static buffers must not be shared by two batches at once
+        self._lock = threading.Lock()
+        self._static_inputs = {}
+        self._static_logits = {}
+        self._graphs = {}
+        # Autocast's weight cast cache must be off while capturing
+        def autocast():
+            return torch.autocast(
+                device_type="cuda", dtype=model.dtype, enabled=model.dtype != torch.float32, cache_enabled=False
+            )
+
+        # Largest bucket first, so the smaller graphs reuse its blocks from the shared memory pool
+        memory_pool = torch.cuda.graph_pool_handle()
+        for bucket in sorted(BATCH_BUCKETS, reverse=True):
+            static_input = torch.zeros(bucket, 3, IMG_SIZE, IMG_SIZE, device=model.device, dtype=model.dtype)
+            static_input = static_input.to(memory_format=memory_format)
+
+            # Warm up on a side stream so lazy initialization is not captured
+            side_stream = torch.cuda.Stream()
+            side_stream.wait_stream(torch.cuda.current_stream())
+            with torch.no_grad(), autocast(), torch.cuda.stream(side_stream):
+                for _ in range(3):
+                    model(pixel_values=static_input)
+            torch.cuda.current_stream().wait_stream(side_stream)
+
+            graph = torch.cuda.CUDAGraph()
+            with torch.no_grad(), autocast(), torch.cuda.graph(graph, pool=memory_pool):
+                self._static_logits[bucket] = model(pixel_values=static_input).logits
+            self._static_inputs[bucket] = static_input
+            self._graphs[bucket] = graph
+
+    def __call__(self, pixel_values):
+        """Return the (N, num_classes) logits of a (N, 3, 384, 384) CUDA batch, N <= MAX_BATCH_SIZE."""
+        num_images = pixel_values.shape[0]
+        bucket = get_batch_bucket(num_images)
+        with self._lock:
+            static_input = self._static_inputs[bucket]
+            static_input[:num_images].copy_(pixel_values, non_blocking=True)
+            static_input[num_images:].zero_()
+            self._graphs[bucket].replay()
+            return self._static_logits[bucket][:num_images].clone()
+
+
+def capture_cuda_graph(model):
+    """Return a CUDAGraphClassifier for model, or None (eager PyTorch is used) when capture fails."""
+    try:
+        return CUDAGraphClassifier(model)
+    except Exception as e:
+        print(f"Warning: CUDA graph capture failed for the skin model, using eager PyTorch: {e}")
+        return None
+
+
+def classify_batch(pixel_values):
+    """Run one classification forward over a (N, 3, 384, 384) batch and return its logits."""
+    if skin_ort_model is not None:
+        return skin_ort_model(pad_to_bucket(pixel_values))[:pixel_values.shape[0]]
+    if skin_compiled_model is not None:
+        num_images = pixel_values.shape[0]
+        with torch.inference_mode(), inference_autocast(skin_model):
+            # Copy the logits out of the compiled model's CUDA-graph output buffer
+            return skin_compiled_model(pixel_values=pad_to_bucket(pixel_values)).logits[:num_images].clone()
+    if skin_graph_runner is not None:
+        return skin_graph_runner(pixel_values)
+    with torch.inference_mode(), inference_autocast(skin_model):
+        return skin_model(pixel_values=pixel_values).logits
+
+
+# Queues one preprocessed image for batched classification and waits for its (1, num_classes) logits
+classify_pixel_values = MicroBatcher(classify_batch, MAX_BATCH_SIZE, BATCH_WINDOW)
+
+
+def warm_up_model(model):
+    """
+    Run the eager attention-capturing forward once on a dummy image, so cuDNN / kernel selection,
+    workspace allocation and lazy initialization happen at load time instead of on the first request.
+    """
+    try:
+        dummy = torch.zeros(1, 3, IMG_SIZE, IMG_SIZE, device=model.device, dtype=model.dtype)
+        dummy = dummy.to(memory_format=memory_format)
+        classify_with_attention(model, {"pixel_values": dummy})
+        if model.device.type == "cuda":
+            torch.cuda.synchronize()
+    except Exception as e:
+        print(f"Warning: skin model warm-up failed: {e}")
 
 
 def load_skin_model():
     """Load the Vision Transformer model and processor from local file."""
-    global skin_model, processor, device
+    global skin_model, skin_ort_model, skin_compiled_model, skin_graph_runner, processor, device, memory_format
+    global ID2LABEL, ID2RESULT
     
     if skin_model is None:
         try:
@@ -82,7 +244,16 @@ def load_skin_model():
             # Load from local directory
             print(f"Loading ViT model and processor from local directory: {MODEL_PATH}")
             processor = ViTImageProcessor.from_pretrained(MODEL_PATH)
-            skin_model = ViTForImageClassification.from_pretrained(MODEL_PATH)
+            
+            # Half precision on tensor-core GPUs; CPU keeps float32 weights with bf16-capable matmuls
+            model_dtype = get_inference_dtype()
+            if not torch.cuda.is_available():
+                torch.set_float32_matmul_precision("medium")
+            # Fused scaled_dot_product_attention (FlashAttention where available) for the classification
+            # forward; the heatmap's output_attentions forward falls back to eager attention by itself
+            skin_model = ViTForImageClassification.from_pretrained(
+                MODEL_PATH, attn_implementation="sdpa", torch_dtype=model_dtype
+            )
             
             # Set device (CUDA, MPS, or CPU)
             device = torch.device(
@@ -91,7 +262,26 @@ def load_skin_model():
                 else "cpu"
             )
             skin_model = skin_model.to(device)
+            
+            # Channels-last lets cuDNN pick its NHWC (tensor core) kernels for the patch-embedding convolution
+            if device.type == "cuda":
+                skin_model = skin_model.to(memory_format=torch.channels_last)
+                memory_format = torch.channels_last
             skin_model.eval()
+            register_cls_attention_hook(skin_model)
+            ID2LABEL, ID2RESULT = build_label_tables(skin_model.config, SKIN_CANCER_CLASSES, CLASS_TO_RESULT)
+            
+            # Classify with an optimized ONNX Runtime copy (TensorRT / CUDA providers on GPU), else a
+            # compiled copy, or on CUDA without torch.compile a captured CUDA graph (None keeps eager
+            # PyTorch); the attention heatmap needs its forward hook and keeps using the eager model
+            if device.type in ("cuda", "cpu"):
+                skin_ort_model = load_ort_classifier(skin_model, MODEL_SAFETENSORS, IMG_SIZE, BATCH_BUCKETS)
+                if skin_ort_model is None:
+                    skin_compiled_model = compile_classifier(skin_model)
+            if skin_ort_model is None and skin_compiled_model is None and device.type == "cuda":
+                skin_graph_runner = capture_cuda_graph(skin_model)
+            # The heatmap path always runs the eager model, whichever classifier was set up above
+            warm_up_model(skin_model)
             
             print(f"Model loaded successfully on device: {device}")
             if hasattr(skin_model, 'config'):
@@ -105,219 +295,232 @@ def load_skin_model():
     return skin_model, processor, device
 
 
-def preprocess_image(image_file, processor):
+def decode_and_resize(image_source, pin_memory):
+    """
+    Decode an image (path or encoded bytes) to RGB and resize it to the model's input size.
+    Runs on the preprocessing thread pool; OpenCV releases the GIL while it decodes and resizes.
+    Returns the resized (384, 384, 3) uint8 pixels as a tensor (page-locked when pin_memory) and the RGB image.
+    """
+    # Read image (OpenCV >= 4.10 can decode straight to RGB)
+    if isinstance(image_source, str):
+        # If it's a file path
+        img = cv2.imread(image_source, IMREAD_FLAG)
+        if img is None:
+            raise ValueError(f"Could not read image from path: {image_source}")
+    else:
+        img = cv2.imdecode(np.frombuffer(image_source, np.uint8), IMREAD_FLAG)
+        if img is None:
+            raise ValueError("Could not decode image from file object")
+    if IMREAD_FLAG == cv2.IMREAD_COLOR:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    
+    # INTER_AREA approximates the antialiased PIL bilinear downscale of ViTImageProcessor
+    resized = torch.from_numpy(cv2.resize(img, (IMG_SIZE, IMG_SIZE), interpolation=cv2.INTER_AREA))
+    # Page-locked memory lets the host-to-device copy run asynchronously
+    if pin_memory:
+        resized = resized.pin_memory()
+    return resized, img
+
+
+def preprocess_image(image_file, device, dtype):
     """
-    Preprocess image using ViTImageProcessor.
-    The processor will resize to 384x384 and normalize according to preprocessor_config.json.
+    Preprocess image for the ViT model with OpenCV, normalizing on the model's device.
+    Matches preprocessor_config.json: resize to 384x384, rescale by 1/255 and normalize with
+    mean=[0.5, 0.5, 0.5] and std=[0.5, 0.5, 0.5], i.e. x / 127.5 - 1.
+    Decoding runs on the preprocessing thread pool, so other requests' greenlets (and the batch
+    worker feeding the GPU) keep running meanwhile.
     
     Args:
         image_file: File object or image path
-        processor: ViTImageProcessor instance
+        device: Device the model runs on
+        dtype: Model weight dtype
     Returns:
-        Processed inputs (tensors) and original PIL image
+        Processed inputs ({"pixel_values": (1, 3, 384, 384) tensor on device}) and original RGB image array
     """
-    # Read image using PIL
     if isinstance(image_file, str):
-        # If it's a file path
-        img = Image.open(image_file).convert('RGB')
+        image_source = image_file
     else:
         # If it's a file object
         image_file.seek(0)  # Reset file pointer
-        img = Image.open(image_file).convert('RGB')
+        image_source = image_file.read()
+    resized, img = _preprocess_executor.submit(decode_and_resize, image_source, device.type == "cuda").result()
     
-    # Process image using ViT processor
-    # The processor will automatically:
-    # - Resize to 384x384 (from preprocessor_config.json)
-    # - Normalize with mean=[0.5, 0.5, 0.5] and std=[0.5, 0.5, 0.5]
-    # - Rescale by 1/255 (0.00392156862745098)
-    inputs = processor(images=img, return_tensors="pt", padding=True)
+    # Copy the uint8 pixels (a quarter of the float32 bytes) and rescale/normalize on the device;
+    # the layout matches what the compiled model and the CUDA graph were captured with
+    pixel_values = resized.to(device, non_blocking=True).permute(2, 0, 1).unsqueeze(0)
+    pixel_values = pixel_values.to(dtype, memory_format=memory_format).div_(127.5).sub_(1.0)
     
     # Return processed inputs and original image
-    return inputs, img
+    return {"pixel_values": pixel_values}, img
+
+
+def gaussian_blur(image):
+    """
+    Blur a (1, 1, H, W) float32 tensor with the separable 21-tap Gaussian of cv2.GaussianBlur((21, 21), 0),
+    as two 1D convolutions with reflect-101 borders (OpenCV's default).
+    """
+    kernel = BLUR_KERNEL.to(image.device)
+    radius = kernel.numel() // 2
+    image = F.conv2d(F.pad(image, (radius, radius, 0, 0), mode="reflect"), kernel.view(1, 1, 1, -1))
+    return F.conv2d(F.pad(image, (0, 0, radius, radius), mode="reflect"), kernel.view(1, 1, -1, 1))
+
+
+def classify_with_attention(model, inputs):
+    """
+    One eager forward returning the logits and the last layer's [CLS] attention (batch, num_heads, num_patches+1),
+    so the heatmap does not need a second, output_attentions forward.
+    """
+    last_self_attention = model.vit.encoder.layer[-1].attention.attention
+    last_self_attention.stash_attention = True
+    try:
+        with torch.inference_mode(), inference_autocast(model):
+            logits = model(**inputs).logits
+    finally:
+        last_self_attention.stash_attention = False
+    cls_attention = last_self_attention.cls_attention
+    last_self_attention.cls_attention = None
+    return logits, cls_attention
 
 
-def generate_heatmap_vit(image, model, inputs, predicted_class_idx):
+def generate_heatmap_vit(img_array, model, cls_attention, predicted_class_idx):
     """
     Generate attention-based heatmap for ViT model to highlight where the anomaly is.
-    Uses the attention weights from the transformer to create a precise heatmap.
+    Uses the last layer's [CLS] attention (from classify_with_attention) to create a precise heatmap.
+    Upscaling, blurring and normalization run on the model's device.
+    img_array is the original RGB image array; only its size is used.
     """
+    # Get original image size
+    original_height, original_width = img_array.shape[:2]
     try:
-        # Get original image size
-        img_array = np.array(image)
-        original_height, original_width = img_array.shape[:2]
-        
-        # Enable gradient computation for attention
-        model.eval()
-        
-        # Get attention weights from the model
-        # We need to access the attention layers
-        with torch.no_grad():
-            outputs = model(**inputs, output_attentions=True)
-            attentions = outputs.attentions  # List of attention tensors from each layer
         
         # Use the last layer's attention (most relevant for classification)
-        # attentions[-1] shape: (batch, num_heads, num_patches+1, num_patches+1)
-        # We want attention to the [CLS] token (index 0) which aggregates information
-        last_layer_attention = attentions[-1]  # Last transformer layer
-        
-        # Average across all attention heads
-        # Shape: (batch, num_heads, num_patches+1, num_patches+1)
-        # We take attention from all tokens to [CLS] token (column 0), excluding [CLS] itself
-        attention_to_cls = last_layer_attention[0, :, 0, 1:].mean(dim=0)  # Average over heads, exclude [CLS] token
+        # cls_attention shape: (batch, num_heads, num_patches+1)
+        # It is the [CLS] token's (index 0) attention, which aggregates information
+        # Average across all attention heads, excluding [CLS] itself
+        attention_to_cls = cls_attention[0, :, 1:].mean(dim=0)
         
         # Get patch size and number of patches from model config
         patch_size = model.config.patch_size
         image_size = model.config.image_size
         num_patches_per_side = image_size // patch_size
         
-        # Reshape attention to spatial dimensions
+        # Reshape attention to spatial dimensions (kept on the model's device as a 1x1xNxN image)
         # attention_to_cls shape: (num_patches,)
-        attention_map = attention_to_cls.reshape(num_patches_per_side, num_patches_per_side)
+        attention_map = attention_to_cls.reshape(1, 1, num_patches_per_side, num_patches_per_side).float()
         
         # Normalize attention map
-        attention_map = attention_map.cpu().numpy()
         attention_map = (attention_map - attention_map.min()) / (attention_map.max() - attention_map.min() + 1e-8)
         
         # Resize attention map to original image size
-        heatmap = cv2.resize(attention_map, (original_width, original_height), interpolation=cv2.INTER_CUBIC)
+        heatmap = F.interpolate(
+            attention_map, size=(original_height, original_width), mode="bicubic", align_corners=False
+        )
         
         # Apply Gaussian blur for smoother visualization
-        heatmap = cv2.GaussianBlur(heatmap, (21, 21), 0)
+        heatmap = gaussian_blur(heatmap)
         
         # Normalize again after resize
-        if heatmap.max() > 0:
-            heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min())
+        heatmap = heatmap.sub_(heatmap.min()).div_(heatmap.max() + 1e-8)
         
-        # Convert to colored heatmap (0-255 range)
-        heatmap_uint8 = (heatmap * 255).astype(np.uint8)
+        # Convert to 0-255 on the device, so only the uint8 heatmap is copied to the host
+        heatmap_uint8 = heatmap.mul_(255).to(torch.uint8)[0, 0].cpu().numpy()
         heatmap_colored = cv2.applyColorMap(heatmap_uint8, cv2.COLORMAP_JET)
         heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
         
-        return heatmap_colored, heatmap
+        return heatmap_colored, heatmap_uint8
         
     except Exception as e:
         print(f"Error generating attention heatmap: {str(e)}")
         import traceback
         traceback.print_exc()
-        # Fallback: create a simple centered heatmap
-        img_array = np.array(image)
-        original_height, original_width = img_array.shape[:2]
-        heatmap = np.zeros((original_height, original_width), dtype=np.float32)
-        center_y, center_x = original_height // 2, original_width // 2
-        y, x = np.ogrid[:original_height, :original_width]
-        mask = (x - center_x)**2 + (y - center_y)**2 <= min(original_height, original_width)**2 // 4
-        heatmap[mask] = 0.7
-        heatmap_colored = cv2.applyColorMap((heatmap * 255).astype(np.uint8), cv2.COLORMAP_JET)
-        heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
-        return heatmap_colored, heatmap
+        # Fallback: a simple centered heatmap
+        return fallback_heatmap(original_height, original_width)
 
 
 
 
-def predict_skin_cancer(image_file):
+@torch.inference_mode()
+def predict_skin_cancer(image_file, return_heatmap: bool = True):
     """
     Predict skin cancer type from an image using Vision Transformer.
     Args:
         image_file: File object or image path
+        return_heatmap: Whether to generate the attention heatmap; when False the "heatmap" and
+            "heatmap_raw" keys are omitted and the image is classified through the batched path
     Returns:
         Dictionary with predictions, confidence, heatmap, and metrics
     """
     model, processor, device = load_skin_model()
     
-    # Preprocess image
-    inputs, img_original = preprocess_image(image_file, processor)
-    
-    # Move inputs to device
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    
-    # Make prediction
-    with torch.no_grad():
-        outputs = model(**inputs)
-    
-    # Get prediction results
-    logits = outputs.logits
-    probabilities = torch.nn.functional.softmax(logits, dim=1)[0]
-    
-    # Get predicted class index and confidence
-    predicted_class_idx = torch.argmax(probabilities).item()
-    confidence = probabilities[predicted_class_idx].item()
+    # Preprocess image (normalized on the device, in the model's possibly half precision dtype)
+    inputs, img_original = preprocess_image(image_file, device, model.dtype)
     
-    # Get predicted class name from model config or use our mapping
-    if hasattr(model.config, 'id2label') and model.config.id2label:
-        predicted_class = model.config.id2label[predicted_class_idx]
+    # Make prediction; with a heatmap the same forward captures its attention, without one the
+    # image is coalesced with concurrent requests into one forward pass
+    if return_heatmap:
+        logits, cls_attention = classify_with_attention(model, inputs)
     else:
-        # Fallback to our class names if model doesn't have id2label
-        if predicted_class_idx < len(SKIN_CANCER_CLASSES):
-            predicted_class = SKIN_CANCER_CLASSES[predicted_class_idx]
-        else:
-            predicted_class = f"Class_{predicted_class_idx}"
-            print(f"Warning: Predicted class index {predicted_class_idx} out of range")
+        logits = classify_pixel_values(inputs["pixel_values"])
     
-    # Convert probabilities to numpy for easier manipulation
-    probabilities_np = probabilities.cpu().numpy()
-    
-    # Get top 2 predictions
-    top_indices = np.argsort(probabilities_np)[::-1][:min(2, len(probabilities_np))]
-    
-    # Get result type (Malign/Benign/Normal)
-    result_type = CLASS_TO_RESULT.get(predicted_class, "Normal")
+    # Get prediction results (softmax in float32 for numerical safety)
+    logits = logits.float()
+    probabilities = torch.nn.functional.softmax(logits, dim=1)[0]
     
-    # Generate heatmap (simplified - ViT heatmaps are more complex)
-    # For now, create a simple centered heatmap
-    img_array = np.array(img_original)
-    img_size = img_array.shape[0] if len(img_array.shape) == 2 else img_array.shape[1]
-    heatmap_colored, heatmap_raw = generate_heatmap_vit(img_original, model, inputs, predicted_class_idx)
+    # Get top 2 predictions on the device; the first one is the predicted class
+    top_probabilities, top_indices = probabilities.topk(min(2, probabilities.numel()))
+    top_indices = top_indices.tolist()
+    predicted_class_idx = top_indices[0]
+    confidence = top_probabilities[0].item()
     
-    # Overlay heatmap on original image
-    img_original_float = img_array.astype(np.float32) / 255.0
-    heatmap_resized = cv2.resize(heatmap_colored, (img_array.shape[1], img_array.shape[0]))
-    heatmap_float = heatmap_resized.astype(np.float32) / 255.0
+    # Get predicted class name and result type (Malign/Benign/Normal) from the tables built at load time
+    predicted_class = ID2LABEL[predicted_class_idx]
+    result_type = ID2RESULT[predicted_class_idx]
     
-    # Blend images (70% original, 30% heatmap)
-    overlay = cv2.addWeighted(img_original_float, 0.7, heatmap_float, 0.3, 0)
-    overlay_uint8 = (overlay * 255).astype(np.uint8)
+    # Percentages of every class, copied to the host in one transfer
+    probabilities_pct = (probabilities * 100).tolist()
     
     # Calculate metrics
     model_precision = float(confidence * 100)  # Top prediction confidence
     top3_predictions = [
         {
-            "class": model.config.id2label[idx] if hasattr(model.config, 'id2label') and idx in model.config.id2label 
-                     else (SKIN_CANCER_CLASSES[idx] if idx < len(SKIN_CANCER_CLASSES) else f"Class_{idx}"),
-            "confidence": float(probabilities_np[idx] * 100),
-            "result_type": CLASS_TO_RESULT.get(
-                model.config.id2label[idx] if hasattr(model.config, 'id2label') and idx in model.config.id2label 
-                else (SKIN_CANCER_CLASSES[idx] if idx < len(SKIN_CANCER_CLASSES) else "Normal"), 
-                "Normal"
-            )
+            "class": ID2LABEL[idx],
+            "confidence": probabilities_pct[idx],
+            "result_type": ID2RESULT[idx]
         }
         for idx in top_indices
     ]
     
     # Get all predictions
-    all_predictions = {}
-    for i in range(len(probabilities_np)):
-        class_name = model.config.id2label[i] if hasattr(model.config, 'id2label') and i in model.config.id2label else (
-            SKIN_CANCER_CLASSES[i] if i < len(SKIN_CANCER_CLASSES) else f"Class_{i}"
-        )
-        all_predictions[class_name] = float(probabilities_np[i] * 100)
+    all_predictions = dict(zip(ID2LABEL, probabilities_pct))
     
     # Calculate explanation and recommendations
     explanation, recommendations = get_explanation_and_recommendations(
         predicted_class, result_type, confidence * 100
     )
     
-    return {
+    result = {
         "predicted_class": predicted_class,
         "result_type": result_type,
         "confidence": confidence * 100,
         "model_precision": model_precision,
         "top3_predictions": top3_predictions,
         "all_predictions": all_predictions,
-        "heatmap": overlay_uint8,
-        "heatmap_raw": heatmap_colored,
         "explanation": explanation,
         "recommendations": recommendations
     }
+    
+    if return_heatmap:
+        # Generate heatmap from the last layer's [CLS] attention
+        heatmap_colored, heatmap_raw = generate_heatmap_vit(img_original, model, cls_attention, predicted_class_idx)
+        
+        # Overlay heatmap on original image (both already at the original size)
+        # Blend images (70% original, 30% heatmap) directly in uint8
+        overlay_uint8 = cv2.addWeighted(img_original, 0.7, heatmap_colored, 0.3, 0)
+        
+        result["heatmap"] = encode_jpeg_base64(overlay_uint8)
+        result["heatmap_raw"] = encode_jpeg_base64(heatmap_colored)
+    
+    return result
 
 
 def get_explanation_and_recommendations(class_name, result_type, confidence):
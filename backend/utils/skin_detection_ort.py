@@ -0,0 +1,148 @@
+"""
+ONNX Runtime copy of the skin cancer ViT for serving the batched classification path.
+The model is exported to ONNX once with a dynamic batch dimension, its attention / LayerNorm / GELU
+subgraphs are fused by ONNX Runtime's transformer optimizer, and the result is run with the TensorRT or
+CUDA execution provider on GPU (CPU provider otherwise). Importers fall back to PyTorch when ONNX
+Runtime is unavailable.
+"""
+
+import copy
+import os
+import threading
+import numpy as np
+import torch
+from utils.vit_helpers import LogitsOnly
+
+# ONNX Runtime is optional; without it the PyTorch model is used
+try:
+    import onnxruntime as ort
+    from onnxruntime.transformers import optimizer
+    ORT_AVAILABLE = True
+except Exception:
+    ORT_AVAILABLE = False
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "model", "skin-cancer")
+ONNX_FILE = os.path.join(MODEL_PATH, "vit_skin.onnx")
+OPTIMIZED_FILE = os.path.join(MODEL_PATH, "vit_skin_opt.onnx")
+OPTIMIZED_FP16_FILE = os.path.join(MODEL_PATH, "vit_skin_opt_fp16.onnx")
+TRT_CACHE_DIR = os.path.join(MODEL_PATH, "trt_cache")
+
+INPUT_NAME = "pixel_values"
+OUTPUT_NAME = "logits"
+ONNX_OPSET = 17
+
+
+class ORTSkinClassifier:
+    """ONNX Runtime session returning (N, num_classes) float32 logits for a (N, 3, 384, 384) batch."""
+
+    def __init__(self, model_file: str, device: torch.device, num_labels: int):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._device = device
+        self._num_labels = num_labels
+        self._session = ort.InferenceSession(model_file, options, providers=get_providers(device))
+        # An IO binding must not be used by two batches at once
+        self._lock = threading.Lock()
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        pixel_values = pixel_values.float().contiguous()
+        if self._device.type != "cuda":
+            logits = self._session.run([OUTPUT_NAME], {INPUT_NAME: pixel_values.numpy()})[0]
+            return torch.from_numpy(logits)
+
+        # Bind PyTorch's device buffers directly, so the batch never round-trips through the host
+        logits = torch.empty((pixel_values.shape[0], self._num_labels), dtype=torch.float32, device=self._device)
+        device_id = self._device.index or 0
+        with self._lock:
+            binding = self._session.io_binding()
+            binding.bind_input(
+                INPUT_NAME, "cuda", device_id, np.float32, tuple(pixel_values.shape), pixel_values.data_ptr()
+            )
+            binding.bind_output(OUTPUT_NAME, "cuda", device_id, np.float32, tuple(logits.shape), logits.data_ptr())
+            # ONNX Runtime runs on its own stream; the input must be ready before it starts
+            torch.cuda.current_stream().synchronize()
+            self._session.run_with_iobinding(binding)
+        return logits
+
+
+def get_providers(device: torch.device) -> list:
+    """TensorRT (FP16, engine cache on disk), then CUDA, then CPU, restricted to the installed providers."""
+    available = set(ort.get_available_providers())
+    providers = []
+    if device.type == "cuda":
+        if "TensorrtExecutionProvider" in available:
+            os.makedirs(TRT_CACHE_DIR, exist_ok=True)
+            providers.append(("TensorrtExecutionProvider", {
+                "trt_fp16_enable": True,
+                "trt_engine_cache_enable": True,
+                "trt_engine_cache_path": TRT_CACHE_DIR,
+            }))
+        if "CUDAExecutionProvider" in available:
+            providers.append("CUDAExecutionProvider")
+    providers.append("CPUExecutionProvider")
+    return providers
+
+
+def export_to_onnx(model, image_size: int, onnx_file: str = ONNX_FILE) -> None:
+    """Export a float32 copy of the ViT to ONNX with a dynamic batch dimension."""
+    export_model = LogitsOnly(copy.deepcopy(model).float().eval())
+    # The exporter traces eager attention ops; SDPA is fused back by the optimizer
+    export_model.model.config._attn_implementation = "eager"
+    dummy = torch.zeros(1, 3, image_size, image_size, device=next(model.parameters()).device)
+    with torch.no_grad():
+        torch.onnx.export(
+            export_model, (dummy,), onnx_file, opset_version=ONNX_OPSET,
+            input_names=[INPUT_NAME], output_names=[OUTPUT_NAME],
+            dynamic_axes={INPUT_NAME: {0: "batch"}, OUTPUT_NAME: {0: "batch"}}
+        )
+
+
+def optimize_onnx(config, use_fp16: bool, onnx_file: str = ONNX_FILE) -> str:
+    """Fuse the exported graph with ONNX Runtime's ViT optimizer and return the optimized file."""
+    optimized_file = OPTIMIZED_FP16_FILE if use_fp16 else OPTIMIZED_FILE
+    optimized_model = optimizer.optimize_model(
+        onnx_file, model_type="vit", num_heads=config.num_attention_heads, hidden_size=config.hidden_size
+    )
+    if use_fp16:
+        # TensorRT picks its own precision; the CUDA provider needs float16 weights for tensor cores
+        optimized_model.convert_float_to_float16(keep_io_types=True)
+    optimized_model.save_model_to_file(optimized_file)
+    return optimized_file
+
+
+def load_ort_classifier(model, source_file: str, image_size: int, batch_sizes=(1,)):
+    """
+    Return an ORTSkinClassifier for model, warmed up for each of batch_sizes, or None when ONNX Runtime
+    cannot be used. The optimized ONNX model is cached next to the weights and rebuilt when source_file is newer.
+    """
+    if not ORT_AVAILABLE:
+        return None
+
+    device = next(model.parameters()).device
+    available = set(ort.get_available_providers())
+    use_fp16 = (
+        device.type == "cuda"
+        and "TensorrtExecutionProvider" not in available
+        and "CUDAExecutionProvider" in available
+    )
+    optimized_file = OPTIMIZED_FP16_FILE if use_fp16 else OPTIMIZED_FILE
+
+    try:
+        is_fresh = (
+            os.path.exists(optimized_file)
+            and os.path.getmtime(optimized_file) >= os.path.getmtime(source_file)
+        )
+        if not is_fresh:
+            print("Exporting and optimizing the skin detection model for ONNX Runtime...")
+            export_to_onnx(model, image_size)
+            optimize_onnx(model.config, use_fp16)
+            print(f"Optimized skin detection model saved to: {optimized_file}")
+
+        classifier = ORTSkinClassifier(optimized_file, device, model.config.num_labels)
+        # The first run of each shape is where the providers (TensorRT especially) build their kernels
+        for batch_size in batch_sizes:
+            classifier(torch.zeros(batch_size, 3, image_size, image_size, device=device))
+        return classifier
+    except Exception as e:
+        print(f"Warning: ONNX Runtime skin model unavailable, using PyTorch: {e}")
+        return None
@@ -0,0 +1,17 @@
+"""
+TensorFlow device configuration shared by the Keras models (UNet and diabetic retinopathy).
+"""
+import tensorflow as tf
+
+GPUS = tf.config.list_physical_devices("GPU")
+
+# Let each worker process grow its GPU allocation instead of reserving the whole device up front
+for _gpu in GPUS:
+    try:
+        tf.config.experimental.set_memory_growth(_gpu, True)
+    except RuntimeError:
+        # The runtime was already initialized by an earlier import
+        pass
+
+# Explicit placement for inference, so ops never silently fall back to the CPU on a GPU host
+INFERENCE_DEVICE = "/GPU:0" if GPUS else "/CPU:0"
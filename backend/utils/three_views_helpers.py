@@ -1,11 +1,32 @@
 """
 Helper functions for three-view visualization.
 """
+import cv2
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcolors
 from typing import Tuple, List
-from utils.image_processing_helpers import CLASS_COLOR_MAP, normalize_image_slice, filter_prediction_by_class, create_segmentation_colormap
+from utils.image_processing_helpers import overlay_prediction_rgb, pad_to_square
+
+# Layout of the composed three-view image (each view is letterboxed into a square panel)
+PANEL_SIZE = 480
+TITLE_HEIGHT = 36
+LABEL_HEIGHT = 30
+PANEL_GAP = 8
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+WHITE = (255, 255, 255)
+CROSSHAIR_ALPHA = 0.7
+
+
+def get_view_slices(img: np.ndarray, pred_vol: np.ndarray, axis: int, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return contiguous copies of the image and prediction slices at idx along axis, in display orientation.
+    Sagittal (axis 0) and coronal (axis 1) slices are rotated by 90 degrees.
+    """
+    # Basic indexing returns views, so each slice is copied only once below
+    index = (slice(None),) * axis + (idx,)
+    image_slice, pred_slice = img[index], pred_vol[index]
+    if axis != 2:
+        image_slice, pred_slice = np.rot90(image_slice), np.rot90(pred_slice)
+    return np.ascontiguousarray(image_slice), np.ascontiguousarray(pred_slice)
 
 
 def extract_three_view_slices(
@@ -18,12 +39,9 @@ def extract_three_view_slices(
     y_idx = int(np.clip(voxel_coords[1], 0, img.shape[1] - 1))
     z_idx = int(np.clip(voxel_coords[2], 0, img.shape[2] - 1))
     
-    sagittal_img = np.rot90(img[x_idx, :, :])
-    sagittal_pred = np.rot90(pred_vol[x_idx, :, :])
-    coronal_img = np.rot90(img[:, y_idx, :])
-    coronal_pred = np.rot90(pred_vol[:, y_idx, :])
-    axial_img = img[:, :, z_idx]
-    axial_pred = pred_vol[:, :, z_idx]
+    sagittal_img, sagittal_pred = get_view_slices(img, pred_vol, 0, x_idx)
+    coronal_img, coronal_pred = get_view_slices(img, pred_vol, 1, y_idx)
+    axial_img, axial_pred = get_view_slices(img, pred_vol, 2, z_idx)
     
     return sagittal_img, sagittal_pred, coronal_img, coronal_pred, axial_img, axial_pred
 
@@ -52,42 +70,56 @@ def calculate_crosshair_positions(
     return sag_cross, cor_cross, axial_cross
 
 
-def render_three_views(
-    views: List[Tuple[str, np.ndarray, np.ndarray, Tuple[int, int], str]],
-    coords: dict
-) -> plt.Figure:
-    """Render three orthogonal views with crosshairs and labels."""
-    cmap, norm = create_segmentation_colormap()
+def draw_centered_text(image: np.ndarray, text: str, center_x: int, baseline_y: int, scale: float) -> None:
+    """Draw white text horizontally centered on center_x."""
+    (text_width, _), _ = cv2.getTextSize(text, FONT, scale, 1)
+    cv2.putText(image, text, (center_x - text_width // 2, baseline_y), FONT, scale, WHITE, 1, cv2.LINE_AA)
+
+
+def render_view_panel(
+    title: str,
+    image_slice: np.ndarray,
+    pred_slice: np.ndarray,
+    crosshair_pos: Tuple[int, int],
+    label: str
+) -> np.ndarray:
+    """Compose one titled and labelled view with its overlay and crosshair as an RGB uint8 array."""
+    h, w = image_slice.shape
+    size = max(h, w)
+    top, left = (size - h) // 2, (size - w) // 2
+    scale = PANEL_SIZE / size
+    
+    # Nearest-neighbour upscaling keeps class boundaries crisp, like imshow(interpolation="nearest")
+    view = cv2.resize(
+        pad_to_square(overlay_prediction_rgb(image_slice, pred_slice)),
+        (PANEL_SIZE, PANEL_SIZE), interpolation=cv2.INTER_NEAREST
+    )
     
-    fig, axes = plt.subplots(1, 3, figsize=(15, 5), facecolor="black")
-    fig.subplots_adjust(wspace=0.03, hspace=0)
+    # Crosshair at the centre of the selected voxel, blended at CROSSHAIR_ALPHA
+    row = int((crosshair_pos[0] + top + 0.5) * scale)
+    col = int((crosshair_pos[1] + left + 0.5) * scale)
+    lines = view.copy()
+    cv2.line(lines, (0, row), (PANEL_SIZE - 1, row), WHITE, 1)
+    cv2.line(lines, (col, 0), (col, PANEL_SIZE - 1), WHITE, 1)
+    view = cv2.addWeighted(lines, CROSSHAIR_ALPHA, view, 1 - CROSSHAIR_ALPHA, 0)
     
-    for ax, (title, image_slice, pred_slice, crosshair_pos, label) in zip(axes, views):
-        ax.set_facecolor("black")
-        ax.imshow(image_slice, cmap="gray", vmin=0, vmax=255)
-        
-        mask_show = np.ma.masked_where(pred_slice == 0, pred_slice)
-        if mask_show.count() > 0:
-            ax.imshow(mask_show, cmap=cmap, norm=norm, alpha=0.75, interpolation="nearest")
-        
-        h, w = image_slice.shape
-        ax.axhline(crosshair_pos[0], color="white", linewidth=0.8, alpha=0.7)
-        ax.axvline(crosshair_pos[1], color="white", linewidth=0.8, alpha=0.7)
-        ax.set_title(title, color="white", fontsize=12, pad=8)
-        ax.text(
-            0.5, -0.05, label,
-            transform=ax.transAxes,
-            color="white", fontsize=10,
-            horizontalalignment="center",
-        )
-        
-        if title in ["Sagittal", "Coronal"]:
-            ax.text(0.02, 0.98, "L", transform=ax.transAxes, color="white",
-                   fontsize=11, fontweight="bold", verticalalignment="top")
-            ax.text(0.98, 0.98, "R", transform=ax.transAxes, color="white",
-                   fontsize=11, fontweight="bold", verticalalignment="top",
-                   horizontalalignment="right")
-        ax.axis("off")
+    if title in ["Sagittal", "Coronal"]:
+        cv2.putText(view, "L", (8, 24), FONT, 0.7, WHITE, 2, cv2.LINE_AA)
+        (r_width, _), _ = cv2.getTextSize("R", FONT, 0.7, 2)
+        cv2.putText(view, "R", (PANEL_SIZE - 8 - r_width, 24), FONT, 0.7, WHITE, 2, cv2.LINE_AA)
     
-    return fig
+    panel = np.zeros((TITLE_HEIGHT + PANEL_SIZE + LABEL_HEIGHT, PANEL_SIZE, 3), dtype=np.uint8)
+    panel[TITLE_HEIGHT:TITLE_HEIGHT + PANEL_SIZE] = view
+    draw_centered_text(panel, title, PANEL_SIZE // 2, TITLE_HEIGHT - 10, 0.75)
+    draw_centered_text(panel, label, PANEL_SIZE // 2, TITLE_HEIGHT + PANEL_SIZE + LABEL_HEIGHT - 9, 0.6)
+    return panel
+
 
+def render_three_views(
+    views: List[Tuple[str, np.ndarray, np.ndarray, Tuple[int, int], str]],
+    coords: dict
+) -> np.ndarray:
+    """Render three orthogonal views with crosshairs and labels side by side as one RGB uint8 array."""
+    panels = [render_view_panel(*view) for view in views]
+    gap = np.zeros((panels[0].shape[0], PANEL_GAP, 3), dtype=np.uint8)
+    return cv2.hconcat([panels[0], gap, panels[1], gap, panels[2]])
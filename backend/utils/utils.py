@@ -1,12 +1,15 @@
 import io
+import cv2
 import matplotlib as mpl
+import numpy as np
 import os
 import zipfile
 
 from flask import send_file
+from gevent.threadpool import ThreadPoolExecutor
 from matplotlib import pyplot as plt
 from matplotlib.colors import ListedColormap
-from utils.variables import data_path
+from utils.variables import data_path, modalities_dict
 
 SESSION_STATE = {}
 
@@ -22,15 +25,56 @@ def init_session_state_variables():
     SESSION_STATE.setdefault("pred_gen_for_this_patient", False)
 
 
+# Modality name -> file suffix, built once (first key wins, like the scan in get_key_from_dict)
+_MODALITY_KEYS = {value: key for key, value in reversed(modalities_dict.items())}
+
+
 def get_key_from_dict(modality_dict, val):
+    """Return the first key of modality_dict whose value is val (None if there is none)."""
+    if modality_dict is modalities_dict:
+        try:
+            return _MODALITY_KEYS.get(val)
+        except TypeError:
+            pass
     for key, value in modality_dict.items():
         if val == value:
             return key
 
 
+# The dataset zip is extracted by one native thread per core (zlib releases the GIL while inflating)
+UNZIP_WORKERS = os.cpu_count() or 1
+
+
+def extract_members(path_to_zip_file, members, target_dir):
+    """Extract the given zip members with a ZipFile handle of this thread's own."""
+    with zipfile.ZipFile(path_to_zip_file, 'r') as zip_ref:
+        for member in members:
+            zip_ref.extract(member, target_dir)
+
+
+def parallel_extract(path_to_zip_file, target_dir, workers=UNZIP_WORKERS):
+    """Extract a whole zip archive into target_dir, spreading its members over workers native threads."""
+    with zipfile.ZipFile(path_to_zip_file, 'r') as zip_ref:
+        members = zip_ref.infolist()
+
+    # Create the directories up front, so the workers never race to create the same parent
+    target_root = os.path.abspath(target_dir)
+    for member in members:
+        parent = os.path.abspath(os.path.join(target_root, os.path.dirname(member.filename)))
+        if os.path.commonpath([target_root, parent]) == target_root:
+            os.makedirs(parent, exist_ok=True)
+
+    # Largest members first, dealt round-robin, so each worker inflates about the same amount
+    members.sort(key=lambda member: member.file_size, reverse=True)
+    workers = max(1, min(workers, len(members)))
+    shares = [members[i::workers] for i in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda share: extract_members(path_to_zip_file, share, target_dir), shares))
+
+
 def dataset_unzip():
     """
-    Unzip dataset using basic python, no spinner
+    Unzip dataset using basic python, no spinner (members are extracted in parallel)
     """
     path_to_zip_file = "C:/Users/Home/Downloads/BraTS2020_TrainingData.zip"
     target_dir = "C:/Users/Home/Downloads/BraTS2020_TrainingData"
@@ -39,8 +83,7 @@ def dataset_unzip():
 
     if not os.path.exists(target_dir):
         print("Unzipping dataset...")
-        with zipfile.ZipFile(path_to_zip_file, 'r') as zip_ref:
-            zip_ref.extractall(target_dir)
+        parallel_extract(path_to_zip_file, target_dir)
         print("Unzip complete.")
     else:
         print("Dataset already extracted.")
@@ -70,8 +113,15 @@ def create_colormap():
 
 def fig_to_file(fig):
     """
-    Convert matplotlib figure → BytesIO so Flask route can send it
+    Convert matplotlib figure (or RGB uint8 array) → PNG BytesIO so Flask route can send it
     """
+    if isinstance(fig, np.ndarray):
+        image = cv2.cvtColor(fig, cv2.COLOR_RGB2BGR) if fig.ndim == 3 else fig
+        ok, encoded = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        if not ok:
+            raise ValueError("Failed to encode image as PNG")
+        return io.BytesIO(encoded.tobytes())
+
     buf = io.BytesIO()
     fig.savefig(buf, format="png", bbox_inches="tight")
     buf.seek(0)
@@ -0,0 +1,139 @@
+"""
+Helper functions and containers shared by the Hugging Face ViT classifiers (lung and skin detection)
+and their exported TensorRT / ONNX Runtime copies.
+"""
+import functools
+import math
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import cv2
+import gevent
+import numpy as np
+import torch
+from gevent.event import AsyncResult
+from gevent.queue import Queue, Empty
+
+
+def get_inference_dtype() -> torch.dtype:
+    """Pick the weight dtype: bfloat16 on Ampere+, float16 on Volta/Turing, float32 otherwise."""
+    if torch.cuda.is_available():
+        major, _ = torch.cuda.get_device_capability()
+        if major >= 8 and torch.cuda.is_bf16_supported():
+            return torch.bfloat16
+        if major >= 7:
+            return torch.float16
+    return torch.float32
+
+
+def inference_autocast(model):
+    """Autocast context matching the model's (possibly half precision) weights."""
+    return torch.autocast(device_type=model.device.type, dtype=model.dtype, enabled=model.dtype != torch.float32)
+
+
+def stash_cls_attention(module, args, kwargs, output):
+    """
+    Forward hook on the last ViTSelfAttention layer, active while module.stash_attention is set.
+    Recomputes the [CLS] query's softmax attention from the layer's own query/key projections and
+    keeps it as module.cls_attention, (batch, num_heads, num_patches+1), whatever attention backend ran.
+    """
+    if not getattr(module, "stash_attention", False):
+        return
+    hidden_states = args[0] if args else kwargs["hidden_states"]
+    batch_size = hidden_states.shape[0]
+    num_heads, head_dim = module.num_attention_heads, module.attention_head_size
+    query = module.query(hidden_states[:, :1]).view(batch_size, 1, num_heads, head_dim).transpose(1, 2)
+    key = module.key(hidden_states).view(batch_size, -1, num_heads, head_dim).transpose(1, 2)
+    scores = (query @ key.transpose(-1, -2)).float() / math.sqrt(head_dim)
+    module.cls_attention = scores.softmax(dim=-1)[:, :, 0]
+
+
+def register_cls_attention_hook(model) -> None:
+    """Install stash_cls_attention on the model's last self-attention layer (off until stash_attention is set)."""
+    model.vit.encoder.layer[-1].attention.attention.register_forward_hook(stash_cls_attention, with_kwargs=True)
+
+
+def build_label_tables(config, class_names: Sequence[str], class_to_result: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """
+    Index -> class name and index -> result type lists for every model output.
+    Names come from the model config's id2label, falling back to class_names.
+    """
+    id2label = getattr(config, 'id2label', None) or {}
+    labels = [
+        id2label.get(i, class_names[i] if i < len(class_names) else f"Class_{i}")
+        for i in range(config.num_labels)
+    ]
+    return labels, [class_to_result.get(label, "Normal") for label in labels]
+
+
+@functools.lru_cache(maxsize=16)
+def fallback_heatmap(height: int, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Build the centered disc heatmap used when the attention heatmap fails, as (colored RGB, raw).
+    Cached (read-only), since it only depends on the image size.
+    """
+    heatmap = np.zeros((height, width), dtype=np.float32)
+    center_y, center_x = height // 2, width // 2
+    y, x = np.ogrid[:height, :width]
+    mask = (x - center_x)**2 + (y - center_y)**2 <= min(height, width)**2 // 4
+    heatmap[mask] = 0.7
+    heatmap_colored = cv2.applyColorMap((heatmap * 255).astype(np.uint8), cv2.COLORMAP_JET)
+    heatmap_colored = cv2.cvtColor(heatmap_colored, cv2.COLOR_BGR2RGB)
+    heatmap.setflags(write=False)
+    heatmap_colored.setflags(write=False)
+    return heatmap_colored, heatmap
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-image requests into one classification forward: up to max_batch_size
+    images that arrive within batch_window seconds are concatenated and passed to classify_batch.
+    """
+
+    def __init__(self, classify_batch: Callable[[torch.Tensor], torch.Tensor], max_batch_size: int, batch_window: float):
+        self.classify_batch = classify_batch
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self._queue = Queue()
+        self._worker = None
+
+    def run_batches_forever(self) -> None:
+        """Drain queued requests, grouping those that arrive within the batch window into one forward."""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except Empty:
+                    break
+
+            try:
+                logits = self.classify_batch(torch.cat([pixel_values for pixel_values, _ in batch]))
+                for i, (_, result) in enumerate(batch):
+                    result.set(logits[i:i + 1])
+            except Exception as e:
+                for _, result in batch:
+                    result.set_exception(e)
+
+    def __call__(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Queue one preprocessed image for batched classification and wait for its (1, num_classes) logits."""
+        if self._worker is None or self._worker.dead:
+            self._worker = gevent.spawn(self.run_batches_forever)
+        result = AsyncResult()
+        self._queue.put((pixel_values, result))
+        return result.get()
+
+
+class LogitsOnly(torch.nn.Module):
+    """Wrap the HF classifier so the exported graph has a single logits output."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values).logits